@@ -0,0 +1,46 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.rollups import build_rollups, get_incremental_range
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Dates must be in YYYY-MM-DD format')
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Refresh the daily analytics rollups of reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                        '--lookback',
+                        type=int,
+                        default=7,
+                        help='Always recompute this many recent days, reports are often entered late'
+                        )
+        parser.add_argument('--from', dest='date_from', help='YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='YYYY-MM-DD')
+        parser.add_argument('--chunk-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        date_from, date_to = get_incremental_range(options['lookback'])
+        if options['date_from']:
+            date_from = parse_date(options['date_from'])
+        if options['date_to']:
+            date_to = parse_date(options['date_to'])
+        if date_from > date_to:
+            raise CommandError('--from must not be after --to')
+
+        step = datetime.timedelta(days=options['chunk_days'])
+        start = date_from
+        while start <= date_to:
+            end = min(start + step - datetime.timedelta(days=1), date_to)
+            visits, diagnoses = build_rollups(start, end)
+            self.stdout.write('{} - {}: {} visit rows, {} diagnosis rows'.format(start, end, visits, diagnoses))
+            start = end + datetime.timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS('Rollups are up to date'))
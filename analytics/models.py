@@ -0,0 +1,60 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class VisitRollup(models.Model):
+    date = models.DateField(verbose_name=_("Date"))
+    country = models.ForeignKey('territories.Country', on_delete=models.CASCADE, verbose_name=_("Country"))
+    region = models.ForeignKey('territories.Region', on_delete=models.CASCADE, verbose_name=_("Region"))
+    district = models.ForeignKey('territories.District', on_delete=models.CASCADE, verbose_name=_("District"))
+    company = models.ForeignKey('insurance_companies.Company', on_delete=models.CASCADE, verbose_name=_("Company"))
+    doctor = models.ForeignKey('profiles.Profile', on_delete=models.CASCADE, verbose_name=_("Doctor"))
+    type_of_visit = models.ForeignKey('reports.TypeOfVisit', on_delete=models.CASCADE, verbose_name=_("Type of visit"))
+    visits = models.PositiveIntegerField(default=0, verbose_name=_("Visits"))
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_("Total price"))
+    total_price_doctor = models.DecimalField(
+                                            max_digits=12,
+                                            decimal_places=2,
+                                            default=0,
+                                            verbose_name=_("Total price for the doctor")
+                                            )
+
+    class Meta:
+        unique_together = (('date', 'district', 'company', 'doctor', 'type_of_visit',),)
+        indexes = [
+            models.Index(fields=['country', 'date']),
+            models.Index(fields=['date']),
+        ]
+        verbose_name = _('Visit rollup')
+        verbose_name_plural = _('Visit rollups')
+
+
+class DiagnosisRollup(models.Model):
+    date = models.DateField(verbose_name=_("Date"))
+    country = models.ForeignKey('territories.Country', on_delete=models.CASCADE, verbose_name=_("Country"))
+    region = models.ForeignKey('territories.Region', on_delete=models.CASCADE, verbose_name=_("Region"))
+    company = models.ForeignKey('insurance_companies.Company', on_delete=models.CASCADE, verbose_name=_("Company"))
+    disease = models.ForeignKey('reports.Disease', on_delete=models.CASCADE, verbose_name=_("Disease"))
+    visits = models.PositiveIntegerField(default=0, verbose_name=_("Visits"))
+
+    class Meta:
+        unique_together = (('date', 'region', 'company', 'disease',),)
+        indexes = [
+            models.Index(fields=['country', 'date']),
+            models.Index(fields=['date']),
+        ]
+        verbose_name = _('Diagnosis rollup')
+        verbose_name_plural = _('Diagnosis rollups')
+
+
+class RollupState(models.Model):
+    name = models.CharField(max_length=50, unique=True, verbose_name=_("Name"))
+    last_date = models.DateField(null=True, verbose_name=_("Last date"))
+    updated = models.DateTimeField(auto_now=True, verbose_name=_("Updated"))
+
+    class Meta:
+        verbose_name = _('Rollup state')
+        verbose_name_plural = _('Rollup states')
+
+    def __str__(self):
+        return self.name
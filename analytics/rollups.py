@@ -0,0 +1,125 @@
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum, Min
+from django.utils import timezone
+
+from reports.models import Report, ArchivedReport, ServiceItem, ArchivedServiceItem
+
+from .models import VisitRollup, DiagnosisRollup, RollupState
+
+BATCH_SIZE = 1000
+
+VISIT_KEYS = {
+    'date': 'date_of_visit',
+    'country_id': 'city__district__region__country',
+    'region_id': 'city__district__region',
+    'district_id': 'city__district',
+    'company_id': 'case__company',
+    'doctor_id': 'case__doctor',
+    'type_of_visit_id': 'type_of_visit',
+}
+
+DIAGNOSIS_KEYS = {
+    'date': 'date_of_visit',
+    'country_id': 'city__district__region__country',
+    'region_id': 'city__district__region',
+    'company_id': 'case__company',
+}
+
+
+def prefixed(keys, prefix):
+    return {name: prefix + lookup for name, lookup in keys.items()}
+
+
+def aggregate_visits(date_from, date_to):
+    rows = {}
+    names = list(VISIT_KEYS)
+
+    for model in (Report, ArchivedReport):
+        queryset = (
+            model.objects
+            .filter(date_of_visit__range=(date_from, date_to))
+            .values_list(*VISIT_KEYS.values())
+            .annotate(visits=Count('pk'), price=Sum('visit_price'), price_doctor=Sum('visit_price_doctor'))
+            .order_by()
+        )
+        for *key, visits, price, price_doctor in queryset:
+            row = rows.setdefault(tuple(key), [0, Decimal(0), Decimal(0)])
+            row[0] += visits
+            row[1] += price or 0
+            row[2] += price_doctor or 0
+
+    for model in (ServiceItem, ArchivedServiceItem):
+        lookups = prefixed(VISIT_KEYS, 'report__')
+        queryset = (
+            model.objects
+            .filter(report__date_of_visit__range=(date_from, date_to))
+            .values_list(*lookups.values())
+            .annotate(cost=Sum('cost'), cost_doctor=Sum('cost_doctor'))
+            .order_by()
+        )
+        for *key, cost, cost_doctor in queryset:
+            row = rows.get(tuple(key))
+            if row is not None:
+                row[1] += cost or 0
+                row[2] += cost_doctor or 0
+
+    return [
+        VisitRollup(visits=visits, total_price=price, total_price_doctor=price_doctor, **dict(zip(names, key)))
+        for key, (visits, price, price_doctor) in rows.items()
+    ]
+
+
+def aggregate_diagnoses(date_from, date_to):
+    rows = {}
+    names = list(DIAGNOSIS_KEYS) + ['disease_id']
+
+    for model, report_field in ((Report, 'report__'), (ArchivedReport, 'archivedreport__')):
+        lookups = list(prefixed(DIAGNOSIS_KEYS, report_field).values()) + ['disease']
+        queryset = (
+            model.diagnosis.through.objects
+            .filter(**{report_field + 'date_of_visit__range': (date_from, date_to)})
+            .values_list(*lookups)
+            .annotate(visits=Count('pk'))
+            .order_by()
+        )
+        for *key, visits in queryset:
+            rows[tuple(key)] = rows.get(tuple(key), 0) + visits
+
+    return [DiagnosisRollup(visits=visits, **dict(zip(names, key))) for key, visits in rows.items()]
+
+
+def build_rollups(date_from, date_to):
+    visits = aggregate_visits(date_from, date_to)
+    diagnoses = aggregate_diagnoses(date_from, date_to)
+
+    with transaction.atomic():
+        VisitRollup.objects.filter(date__range=(date_from, date_to)).delete()
+        DiagnosisRollup.objects.filter(date__range=(date_from, date_to)).delete()
+        VisitRollup.objects.bulk_create(visits, batch_size=BATCH_SIZE)
+        DiagnosisRollup.objects.bulk_create(diagnoses, batch_size=BATCH_SIZE)
+        state, created = RollupState.objects.select_for_update().get_or_create(name='reports')
+        if state.last_date is None or state.last_date < date_to:
+            state.last_date = date_to
+            state.save()
+    return len(visits), len(diagnoses)
+
+
+def get_incremental_range(lookback_days):
+    today = timezone.localdate()
+    date_from = today - datetime.timedelta(days=lookback_days)
+    state = RollupState.objects.filter(name='reports').first()
+
+    if state is None or state.last_date is None:
+        first_dates = [
+            model.objects.aggregate(first=Min('date_of_visit'))['first']
+            for model in (Report, ArchivedReport)
+        ]
+        first_dates = [date for date in first_dates if date is not None]
+        if first_dates:
+            date_from = min(first_dates)
+    elif state.last_date < date_from:
+        date_from = state.last_date
+    return date_from, today
@@ -0,0 +1,30 @@
+from rest_framework import serializers
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    BUCKETS = ('day', 'week', 'month', 'year')
+
+    group_by = serializers.CharField(required=False, default='')
+    bucket = serializers.ChoiceField(choices=BUCKETS, default='month')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    country = serializers.IntegerField(required=False)
+    region = serializers.IntegerField(required=False)
+    district = serializers.IntegerField(required=False)
+    company = serializers.IntegerField(required=False)
+    doctor = serializers.IntegerField(required=False)
+    type_of_visit = serializers.IntegerField(required=False)
+    disease = serializers.IntegerField(required=False)
+    top = serializers.IntegerField(required=False, min_value=1, max_value=100)
+
+    def validate_group_by(self, value):
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = set(fields).difference(self.context['group_fields'])
+        if unknown:
+            raise serializers.ValidationError('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+        return fields
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError('date_from must not be after date_to')
+        return data
@@ -0,0 +1,94 @@
+import datetime
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from medical_center.testing import create_city, create_doctor, create_company, create_case, create_report
+from reports.archive import archive_batch
+from reports.models import Disease, Service, ServiceItem
+from .models import VisitRollup, DiagnosisRollup
+from .rollups import build_rollups
+
+DAY = datetime.date(2020, 3, 10)
+
+
+class RollupTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        city = create_city()
+        country = city.district.region.country
+        company = create_company()
+        self.doctor = create_doctor('doctor', city)
+        self.colleague = create_doctor('colleague', city, initials='CL')
+        service = Service.objects.create(name='X-ray', country=country, price=30, price_doctor=20)
+        self.flu = Disease.objects.create(name='Flu', country=country)
+        self.cold = Disease.objects.create(name='Cold', country=country)
+
+        reports = [
+            create_report(create_case(self.doctor, company, 1), date_of_visit=DAY, visit_price=100,
+                          visit_price_doctor=60),
+            create_report(create_case(self.doctor, company, 2), date_of_visit=DAY, visit_price=100,
+                          visit_price_doctor=60),
+            create_report(create_case(self.colleague, company, 3), date_of_visit=DAY + datetime.timedelta(days=1),
+                          visit_price=80, visit_price_doctor=50),
+        ]
+        ServiceItem.objects.create(report=reports[0], service=service, cost=30, cost_doctor=20)
+        reports[0].diagnosis.add(self.flu, self.cold)
+        reports[1].diagnosis.add(self.flu)
+        reports[2].diagnosis.add(self.flu)
+
+        # one of the visits has already moved to the archive
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root):
+            archive_batch([reports[1].pk])
+        build_rollups(DAY, DAY + datetime.timedelta(days=1))
+
+        self.client = APIClient()
+
+    def get(self, name, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(reverse(name), params)
+
+    def test_visit_rollups(self):
+        row = VisitRollup.objects.get(date=DAY, doctor=self.doctor)
+        self.assertEqual(row.visits, 2)
+        self.assertEqual(row.total_price, Decimal('230'))
+        self.assertEqual(row.total_price_doctor, Decimal('140'))
+        self.assertEqual(VisitRollup.objects.get(doctor=self.colleague).visits, 1)
+
+    def test_diagnosis_rollups(self):
+        self.assertEqual(DiagnosisRollup.objects.get(date=DAY, disease=self.flu).visits, 2)
+        self.assertEqual(DiagnosisRollup.objects.get(date=DAY, disease=self.cold).visits, 1)
+
+    def test_rebuild_is_idempotent(self):
+        build_rollups(DAY, DAY)
+        self.assertEqual(VisitRollup.objects.filter(date=DAY).count(), 1)
+
+    def test_top_diseases(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        response = self.get('analytics_diagnoses_url', staff, bucket='year', top=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['disease'], row['visits']) for row in response.data['results']], [(self.flu.pk, 3)])
+
+    def test_staff_sees_every_doctor(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        response = self.get('analytics_visits_url', staff, group_by='doctor', bucket='year')
+        self.assertEqual({row['doctor'] for row in response.data['results']}, {self.doctor.pk, self.colleague.pk})
+
+    def test_doctor_sees_only_own_visits(self):
+        response = self.get('analytics_visits_url', self.doctor.user, group_by='doctor', bucket='year')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['doctor'] for row in response.data['results']], [self.doctor.pk])
+
+    def test_diagnoses_require_permission(self):
+        self.assertEqual(self.get('analytics_diagnoses_url', self.doctor.user).status_code, 403)
+        analyst = create_doctor('analyst', self.doctor.city, initials='AN', permissions=['view_diagnosisrollup'])
+        self.assertEqual(self.get('analytics_diagnoses_url', analyst.user).status_code, 200)
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import VisitAnalyticsView, DiagnosisAnalyticsView
+
+urlpatterns = [
+    path('visits/', VisitAnalyticsView.as_view(), name='analytics_visits_url'),
+    path('diagnoses/', DiagnosisAnalyticsView.as_view(), name='analytics_diagnoses_url'),
+]
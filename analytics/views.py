@@ -0,0 +1,123 @@
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from rest_framework import permissions
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from medical_center.throttling import coalesced
+
+from .models import VisitRollup, DiagnosisRollup
+from .serializers import AnalyticsQuerySerializer
+
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+
+class RollupAnalyticsView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'analytics'
+    model = None
+    # without the model's view permission doctors only see their own rows
+    doctor_field = None
+    # group/filter name -> (id lookup, label lookup)
+    group_fields = {}
+    measures = ()
+
+    def get_queryset(self):
+        queryset = self.model.objects.all()
+        user = self.request.user
+        if user.is_staff:
+            return queryset
+        queryset = queryset.filter(country=user.profile.city.district.region.country)
+        opts = self.model._meta
+        if not user.has_perm('{}.view_{}'.format(opts.app_label, opts.model_name)):
+            if self.doctor_field is None:
+                raise PermissionDenied()
+            queryset = queryset.filter(**{self.doctor_field: user.profile})
+        return queryset
+
+    def filter_queryset(self, queryset, params):
+        if 'date_from' in params:
+            queryset = queryset.filter(date__gte=params['date_from'])
+        if 'date_to' in params:
+            queryset = queryset.filter(date__lte=params['date_to'])
+        for name in self.group_fields:
+            if name in params:
+                queryset = queryset.filter(**{name: params[name]})
+        return queryset
+
+    def get_rows(self, queryset, params):
+        group_by = params['group_by']
+        lookups = ['bucket']
+        for name in group_by:
+            lookups += self.group_fields[name]
+        return list(
+                queryset
+                .annotate(bucket=BUCKETS[params['bucket']]('date'))
+                .values(*lookups)
+                .annotate(**{measure: Sum(measure) for measure in self.measures})
+                .order_by(*lookups)
+                )
+
+    @coalesced
+    def get(self, request):
+        serializer = AnalyticsQuerySerializer(
+                                            data=request.query_params,
+                                            context={'group_fields': self.group_fields}
+                                            )
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        queryset = self.filter_queryset(self.get_queryset(), params)
+        return Response({
+            'bucket': params['bucket'],
+            'group_by': params['group_by'],
+            'results': self.get_rows(queryset, params),
+        })
+
+
+class VisitAnalyticsView(RollupAnalyticsView):
+    model = VisitRollup
+    doctor_field = 'doctor'
+    group_fields = {
+        'country': ('country', 'country__name'),
+        'region': ('region', 'region__name'),
+        'district': ('district', 'district__name'),
+        'company': ('company', 'company__name'),
+        'doctor': ('doctor', 'doctor__initials'),
+        'type_of_visit': ('type_of_visit', 'type_of_visit__name'),
+    }
+    measures = ('visits', 'total_price', 'total_price_doctor')
+
+
+class DiagnosisAnalyticsView(RollupAnalyticsView):
+    model = DiagnosisRollup
+    group_fields = {
+        'country': ('country', 'country__name'),
+        'region': ('region', 'region__name'),
+        'company': ('company', 'company__name'),
+        'disease': ('disease', 'disease__name'),
+    }
+    measures = ('visits',)
+
+    def get_rows(self, queryset, params):
+        if 'disease' not in params['group_by']:
+            params['group_by'] = params['group_by'] + ['disease']
+        rows = super(DiagnosisAnalyticsView, self).get_rows(queryset, params)
+        top = params.get('top')
+        if not top:
+            return rows
+
+        # keep the most frequent diseases of every bucket and group
+        groups = {}
+        for row in rows:
+            key = tuple(row[name] for name in ['bucket'] + params['group_by'] if name != 'disease')
+            groups.setdefault(key, []).append(row)
+        result = []
+        for group in groups.values():
+            result += sorted(group, key=lambda row: -row['visits'])[:top]
+        return result
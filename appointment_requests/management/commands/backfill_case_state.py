@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from appointment_requests.models import InsuranceCase
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Recompute the workflow state and country of insurance cases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        last = InsuranceCase.objects.aggregate(last=Max('pk'))['last'] or 0
+        batch_size = options['batch_size']
+        updated = 0
+        for start in range(0, last + 1, batch_size):
+            cases = InsuranceCase.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+            updated += cases.refresh_state()
+            cases.refresh_country()
+        self.stdout.write(self.style.SUCCESS('Updated {} cases'.format(updated)))
@@ -1,9 +1,90 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, When, Value, Exists, OuterRef, Subquery
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
 from django.shortcuts import reverse
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.utils.translation import ugettext_lazy as _
 
 
+# case fields the full ref. number of its report is built from
+REPORT_REF_FIELDS = {'company', 'company_id', 'doctor', 'doctor_id', 'ref_number', 'date_time'}
+REPORT_REF_ATTNAMES = ('company_id', 'doctor_id', 'ref_number', 'date_time')
+
+
+class InsuranceCaseQuerySet(models.QuerySet):
+
+    def queue(self, state):
+        return self.filter(state=state).order_by('date_time', 'pk')
+
+    def refresh_state(self):
+        """
+        Recompute the workflow state of the cases from their status and
+        whether a live or archived report exists.
+        """
+        from reports.models import Report, ArchivedReport
+
+        return self.update(state=Case(
+                    When(Exists(Report.objects.filter(case=OuterRef('pk'))), then=Value('reported')),
+                    When(Exists(ArchivedReport.objects.filter(case=OuterRef('pk'))), then=Value('reported')),
+                    When(status='accepted', then=Value('pending')),
+                    default=Value('closed'),
+                    ))
+
+    def refresh_country(self):
+        from profiles.models import Profile
+
+        country = Profile.objects.filter(pk=OuterRef('doctor')).values('city__district__region__country')[:1]
+        return self.update(country=Subquery(country))
+
+    def transition(self, status):
+        """
+        Set the status of the cases allowed to move to it and return the
+        ids of the updated cases. The update is guarded by the current
+        state, so a case reported meanwhile is left alone.
+        """
+        from audit.recorder import record
+
+        sources, state = InsuranceCase.TRANSITIONS[status]
+        with transaction.atomic():
+            cases = dict(
+                    self.select_for_update()
+                    .filter(state__in=sources)
+                    .exclude(status=status)
+                    .values_list('pk', 'status')
+                    )
+            if not cases:
+                return []
+            InsuranceCase.objects.filter(pk__in=cases, state__in=sources).update(status=status, state=state)
+            for pk, old_status in cases.items():
+                record(InsuranceCase, pk, 'update', {'status': [old_status, status]})
+        return sorted(cases)
+
+    def restamp(self, batch_size=1000):
+        """
+        Recompute the stored ref. numbers and display strings of the cases
+        and the full ref. numbers of their reports.
+        """
+        from reports.models import Report, ArchivedReport
+
+        cases = self.select_related('company', 'doctor').order_by('pk')
+        changed = []
+        for case in cases.iterator(chunk_size=batch_size):
+            ref, display = case.ref, case.display
+            case.stamp()
+            if (ref, display) != (case.ref, case.display):
+                changed.append(case)
+            if len(changed) >= batch_size:
+                InsuranceCase.objects.bulk_update(changed, ['ref', 'display'])
+                changed = []
+        if changed:
+            InsuranceCase.objects.bulk_update(changed, ['ref', 'display'])
+
+        case_ids = self.values('pk')
+        Report.objects.filter(case__in=case_ids).restamp(batch_size)
+        ArchivedReport.objects.filter(case__in=case_ids).restamp(batch_size)
+
+
 class InsuranceCase(models.Model):
     STATUS = (
         ('accepted', _('Is accepted')),
@@ -12,6 +93,20 @@ class InsuranceCase(models.Model):
         ('failed', _('The visit did not take place')),
     )
 
+    STATE = (
+        ('pending', _('Waiting for report')),
+        ('reported', _('Reported')),
+        ('closed', _('Closed')),
+    )
+
+    # status -> (states the case may be in, state after the transition)
+    TRANSITIONS = {
+        'accepted': (('closed',), 'pending'),
+        'cancelled_by_company': (('pending', 'closed'), 'closed'),
+        'wrong_data': (('pending', 'closed'), 'closed'),
+        'failed': (('pending', 'closed'), 'closed'),
+    }
+
     doctor = models.ForeignKey(
                                 'profiles.Profile',
                                 on_delete=models.PROTECT,
@@ -26,10 +121,27 @@ class InsuranceCase(models.Model):
     company = models.ForeignKey('insurance_companies.Company', on_delete=models.PROTECT, verbose_name=_("Company"))
     sender = models.ForeignKey('profiles.Profile', on_delete=models.PROTECT, verbose_name=_('Sender'))
     status = models.CharField(max_length=20, choices=STATUS, default='accepted', verbose_name=_('Status'))
+    ref = models.CharField(max_length=15, blank=True, db_index=True, editable=False, verbose_name=_("Ref."))
+    display = models.CharField(max_length=150, blank=True, editable=False, verbose_name=_("Display"))
+    state = models.CharField(max_length=10, choices=STATE, default='pending', editable=False, verbose_name=_('State'))
+    country = models.ForeignKey(
+                                'territories.Country',
+                                on_delete=models.PROTECT,
+                                related_name='cases',
+                                null=True,
+                                editable=False,
+                                verbose_name=_("Country")
+                                )
+
+    objects = InsuranceCaseQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('Insurance Case')
         verbose_name_plural = _('Insurance Cases')
+        indexes = [
+            models.Index(fields=['doctor', 'state', 'date_time']),
+            models.Index(fields=['country', 'state', 'date_time']),
+        ]
 
     def validate_unique(self, exclude=None):
         country = self.doctor.city.district.region.country
@@ -49,22 +161,118 @@ class InsuranceCase(models.Model):
                                   )
                                  )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(InsuranceCase, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def report_ref_changed(self, update_fields=None):
+        """
+        Whether a field the reports' full ref. numbers are built from
+        differs from the value loaded from the database.
+        """
+        if update_fields is not None and not REPORT_REF_FIELDS.intersection(update_fields):
+            return False
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(
+                attname not in loaded or loaded[attname] != getattr(self, attname)
+                for attname in REPORT_REF_ATTNAMES
+                )
+
     def save(self, *args, **kwargs):
         self.validate_unique()
-        super(InsuranceCase, self).save(*args, **kwargs)
+        self.country_id = self.doctor.city.district.region.country_id
+        adding = self._state.adding
+        if adding:
+            self.state = 'pending' if self.status == 'accepted' else 'closed'
+        self.stamp()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            kwargs['update_fields'] = update_fields | {'ref', 'display'}
+            if update_fields & {'doctor', 'doctor_id'}:
+                kwargs['update_fields'].add('country')
+        restamp = not adding and self.report_ref_changed(update_fields)
+        # the in-memory state may predate a report, derive it in the database
+        refresh = not adding and (update_fields is None or 'status' in update_fields)
+        with transaction.atomic():
+            super(InsuranceCase, self).save(*args, **kwargs)
+            if refresh:
+                cases = InsuranceCase.objects.filter(pk=self.pk)
+                cases.refresh_state()
+                self.state = cases.values_list('state', flat=True).get()
+        saved = kwargs.get('update_fields')
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if saved is None or field.name in saved or field.attname in saved:
+                self._loaded_values[field.attname] = getattr(self, field.attname)
+        if restamp:
+            from reports.models import Report, ArchivedReport
+            Report.objects.filter(case=self).restamp()
+            ArchivedReport.objects.filter(case=self).restamp()
 
-    def __str__(self):
-        return ' '.join((
+    def stamp(self):
+        self.ref = str(self.company.initials) + str(self.ref_number).zfill(3)
+        self.display = ' '.join((
                         str(self.company.initials),
                         str(self.ref_number).zfill(3),
                         str(' '.join(self.message.split()[:2])),
                         str(self.date_time.strftime('%d.%m.%Y %H:%M')),
                         str(self.doctor.initials)
-                        ))
+                        ))[:150]
+
+    def __str__(self):
+        if not self.display:
+            self.stamp()
+        return self.display
 
     def has_report(self):
-        return hasattr(self, 'report') and self.report is not None
+        # a report moved to the archive still counts
+        for name in ('report', 'archived_report'):
+            try:
+                getattr(self, name)
+            except ObjectDoesNotExist:
+                continue
+            return True
+        return False
 
     def get_update_url(self):
         return reverse('report_request_update_url', kwargs={'pk': self.pk})
 
+
+@receiver(pre_save, sender='profiles.Profile')
+def doctor_snapshot(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_values = (
+                        sender.objects.filter(pk=instance.pk)
+                        .values('city', 'initials', 'is_foreign_doctor')
+                        .first()
+                        )
+
+
+@receiver(post_save, sender='profiles.Profile')
+def doctor_changed(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_values', None)
+    if created or old is None:
+        return
+    cases = InsuranceCase.objects.filter(doctor=instance)
+    if old['city'] != instance.city_id:
+        cases.refresh_country()
+    if old['initials'] != instance.initials or old['is_foreign_doctor'] != instance.is_foreign_doctor:
+        cases.restamp()
+
+
+@receiver(pre_save, sender='insurance_companies.Company')
+def company_snapshot(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_initials = sender.objects.filter(pk=instance.pk).values_list('initials', flat=True).first()
+
+
+@receiver(post_save, sender='insurance_companies.Company')
+def company_changed(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_old_initials', instance.initials) != instance.initials:
+        InsuranceCase.objects.filter(company=instance).restamp()
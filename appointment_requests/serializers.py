@@ -0,0 +1,20 @@
+from rest_framework import serializers
+
+from .models import InsuranceCase
+
+
+class InsuranceCaseSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = InsuranceCase
+        fields = '__all__'
+        read_only_fields = ('state', 'country')
+
+
+class InsuranceCaseTransitionSerializer(serializers.Serializer):
+    cases = serializers.ListField(
+                                child=serializers.IntegerField(min_value=1),
+                                allow_empty=False,
+                                max_length=500
+                                )
+    status = serializers.ChoiceField(choices=list(InsuranceCase.TRANSITIONS))
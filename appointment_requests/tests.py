@@ -1,3 +1,130 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from medical_center.testing import create_city, create_doctor, create_company, create_case, create_report
+from reports.models import Report, ReportQuerySet
+from .models import InsuranceCase
+
+
+class InsuranceCaseStampTest(TestCase):
+
+    def setUp(self):
+        self.doctor = create_doctor('doctor', create_city())
+        self.company = create_company()
+        date_time = timezone.make_aware(datetime.datetime(2020, 3, 5, 10, 30))
+        self.case = create_case(self.doctor, self.company, ref_number=7, date_time=date_time)
+        self.report = create_report(self.case)
+
+    def full_ref_number(self):
+        return Report.objects.values_list('full_ref_number', flat=True).get(pk=self.report.pk)
+
+    def test_stamp(self):
+        case = InsuranceCase.objects.get(pk=self.case.pk)
+        self.assertEqual(case.ref, 'CO007')
+        self.assertTrue(case.display.startswith('CO 007 Fever and'))
+        self.assertTrue(case.display.endswith('AB'))
+        self.assertEqual(case.country_id, self.doctor.city.district.region.country_id)
+        self.assertEqual(self.full_ref_number(), 'CO007-0503-ABV')
+
+    def test_unchanged_save_does_not_restamp(self):
+        case = InsuranceCase.objects.get(pk=self.case.pk)
+        with mock.patch.object(ReportQuerySet, 'restamp') as restamp:
+            case.seen = True
+            case.save()
+            case.save(update_fields=['status'])
+            case.ref_number = 8
+            case.save(update_fields=['seen'])
+        restamp.assert_not_called()
+
+    def test_ref_change_restamps(self):
+        case = InsuranceCase.objects.get(pk=self.case.pk)
+        case.ref_number = 8
+        case.save()
+        self.assertEqual(self.full_ref_number(), 'CO008-0503-ABV')
+        with mock.patch.object(ReportQuerySet, 'restamp') as restamp:
+            case.save()
+        restamp.assert_not_called()
+
+    def test_company_initials_restamp(self):
+        self.company.initials = 'XY'
+        self.company.save()
+        self.assertEqual(InsuranceCase.objects.get(pk=self.case.pk).ref, 'XY007')
+        self.assertEqual(self.full_ref_number(), 'XY007-0503-ABV')
+
+    def test_doctor_initials_restamp(self):
+        self.doctor.initials = 'CD'
+        self.doctor.save()
+        self.assertTrue(InsuranceCase.objects.get(pk=self.case.pk).display.endswith('CD'))
+        self.assertEqual(self.full_ref_number(), 'CO007-0503-CDV')
+
+    def test_transition(self):
+        Report.objects.filter(case=self.case).delete()
+        InsuranceCase.objects.filter(pk=self.case.pk).refresh_state()
+        self.assertEqual(InsuranceCase.objects.filter(pk=self.case.pk).transition('failed'), [self.case.pk])
+        case = InsuranceCase.objects.get(pk=self.case.pk)
+        self.assertEqual((case.status, case.state), ('failed', 'closed'))
+        self.assertEqual(InsuranceCase.objects.filter(pk=self.case.pk).transition('failed'), [])
+
+
+class InsuranceCaseStateTest(TestCase):
+
+    def setUp(self):
+        self.doctor = create_doctor('doctor', create_city())
+        self.company = create_company()
+        self.case = create_case(self.doctor, self.company)
+
+    def state(self, case=None):
+        return InsuranceCase.objects.values_list('state', flat=True).get(pk=(case or self.case).pk)
+
+    def test_report_create_and_delete(self):
+        self.assertEqual(self.state(), 'pending')
+        report = create_report(self.case)
+        self.assertEqual(self.state(), 'reported')
+        report.delete()
+        self.assertEqual(self.state(), 'pending')
+
+    def test_status_saved_with_update_fields(self):
+        self.case.status = 'failed'
+        self.case.save(update_fields=['status'])
+        self.assertEqual(self.state(), 'closed')
+        self.assertEqual(list(InsuranceCase.objects.queue('pending')), [])
+        self.assertEqual(list(InsuranceCase.objects.queue('closed')), [self.case])
+
+    def test_stale_instance_keeps_reported(self):
+        create_report(self.case)
+        self.case.seen = True
+        self.case.save()
+        self.assertEqual(self.state(), 'reported')
+        self.assertEqual(self.case.state, 'reported')
+
+    def test_doctor_saved_with_update_fields(self):
+        other = create_doctor('other', create_city('Lyon', country='France'), initials='OT')
+        self.case.doctor = other
+        self.case.save(update_fields=['doctor'])
+        self.assertEqual(
+                    InsuranceCase.objects.values_list('country', flat=True).get(pk=self.case.pk),
+                    other.city.district.region.country_id
+                    )
+
+    def test_queue(self):
+        later = create_case(self.doctor, self.company, ref_number=2, date_time=self.case.date_time + datetime.timedelta(hours=1))
+        earlier = create_case(self.doctor, self.company, ref_number=3, date_time=self.case.date_time - datetime.timedelta(hours=1))
+        create_report(later)
+        self.assertEqual(list(InsuranceCase.objects.queue('pending')), [earlier, self.case])
+        self.assertEqual(list(InsuranceCase.objects.queue('reported')), [later])
+
+    def test_backfill(self):
+        create_report(self.case)
+        closed = create_case(self.doctor, self.company, ref_number=2, status='failed')
+        InsuranceCase.objects.update(state='pending', country=None)
+
+        call_command('backfill_case_state', batch_size=1, stdout=StringIO())
 
-# Create your tests here.
+        self.assertEqual(self.state(), 'reported')
+        self.assertEqual(self.state(closed), 'closed')
+        self.assertFalse(InsuranceCase.objects.filter(country=None).exists())
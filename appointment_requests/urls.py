@@ -0,0 +1,7 @@
+from rest_framework.routers import DefaultRouter
+from .views import InsuranceCaseViewSet
+
+router = DefaultRouter()
+router.register(r'cases', InsuranceCaseViewSet, basename='case')
+
+urlpatterns = router.urls
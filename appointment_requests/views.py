@@ -1,3 +1,42 @@
-from django.shortcuts import render
+from rest_framework import viewsets
+from rest_framework import permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
+import django_filters.rest_framework
 
-# Create your views here.
+from .models import InsuranceCase
+from .serializers import InsuranceCaseSerializer, InsuranceCaseTransitionSerializer
+
+
+class InsuranceCaseViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Work queues of cases, e.g. ?state=pending lists the accepted cases
+    still waiting for a report, oldest first.
+    """
+    permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    serializer_class = InsuranceCaseSerializer
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+    filterset_fields = ['state', 'status', 'doctor', 'company', 'country', 'ref']
+
+    def get_queryset(self):
+        queryset = InsuranceCase.objects.order_by('date_time', 'pk')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(doctor=self.request.user.profile)
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def transition(self, request):
+        if not request.user.has_perm('appointment_requests.change_insurancecase'):
+            raise PermissionDenied()
+        serializer = InsuranceCaseTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = set(serializer.validated_data['cases'])
+        status = serializer.validated_data['status']
+
+        updated = self.get_queryset().filter(pk__in=requested).transition(status)
+        return Response({
+            'status': status,
+            'updated': updated,
+            'skipped': sorted(requested.difference(updated)),
+        })
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class AuditConfig(AppConfig):
+    name = 'audit'
+
+    def ready(self):
+        from .signals import connect_tracked_models
+        connect_tracked_models()
@@ -0,0 +1,17 @@
+from .recorder import begin_request, end_request
+
+
+class AuditMiddleware:
+    """
+    Collects the audit entries of a request and writes them at its end.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        begin_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            end_request()
@@ -0,0 +1,64 @@
+import json
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+
+def get_month(value):
+    return value.year * 100 + value.month
+
+
+class AuditEntry(models.Model):
+    """
+    Append-only field level history. ``month`` (YYYYMM) leads every index so
+    lookups only ever scan one month range of the table.
+    """
+    ACTIONS = (
+        ('create', _('Created')),
+        ('update', _('Updated')),
+        ('delete', _('Deleted')),
+        ('archive', _('Archived')),
+    )
+
+    month = models.PositiveIntegerField(verbose_name=_("Month"))
+    created = models.DateTimeField(default=timezone.now, verbose_name=_("Created"))
+    user = models.ForeignKey(
+                            settings.AUTH_USER_MODEL,
+                            on_delete=models.DO_NOTHING,
+                            db_constraint=False,
+                            null=True,
+                            related_name='+',
+                            verbose_name=_("User")
+                            )
+    content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT, verbose_name=_("Object type"))
+    object_id = models.PositiveIntegerField(verbose_name=_("Object id"))
+    action = models.CharField(max_length=10, choices=ACTIONS, verbose_name=_("Action"))
+    changes = models.TextField(verbose_name=_("Changes"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'content_type', 'object_id']),
+            models.Index(fields=['month', 'user']),
+        ]
+        ordering = ('-created',)
+        verbose_name = _('Audit entry')
+        verbose_name_plural = _('Audit entries')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Audit entries are append-only')
+        if self.month is None:
+            self.month = get_month(self.created)
+        super(AuditEntry, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Audit entries are append-only')
+
+    def get_changes(self):
+        return json.loads(self.changes)
+
+    def __str__(self):
+        return ' '.join((str(self.content_type), str(self.object_id), self.action))
@@ -0,0 +1,105 @@
+import json
+import contextlib
+
+from asgiref.local import Local
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AuditEntry, get_month
+
+_local = Local()
+
+
+def encode(changes):
+    return json.dumps(changes, separators=(',', ':'), sort_keys=True, default=str)
+
+
+def get_current_user():
+    request = getattr(_local, 'request', None)
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
+
+
+def is_suppressed():
+    return getattr(_local, 'suppressed', 0) > 0
+
+
+@contextlib.contextmanager
+def suppressed():
+    """
+    Ignore the signal driven entries inside the block, for bulk operations
+    that record their own entry (e.g. archiving deletes the live report).
+    """
+    _local.suppressed = getattr(_local, 'suppressed', 0) + 1
+    try:
+        yield
+    finally:
+        _local.suppressed -= 1
+
+
+def begin_request(request):
+    _local.request = request
+    _local.request_entries = []
+
+
+def end_request():
+    entries = getattr(_local, 'request_entries', None)
+    _local.request = None
+    _local.request_entries = None
+    if entries:
+        AuditEntry.objects.bulk_create(entries)
+
+
+def commit(entries):
+    _local.transaction_entries = None
+    request_entries = getattr(_local, 'request_entries', None)
+    if request_entries is not None:
+        request_entries.extend(entries)
+    elif entries:
+        AuditEntry.objects.bulk_create(entries)
+
+
+def get_transaction_entries(connection, using):
+    pending = getattr(_local, 'transaction_entries', None)
+    # after a rollback the scheduled flush is gone together with the transaction
+    if pending is not None and any(func is pending[1] for sids, func in connection.run_on_commit):
+        return pending[0]
+
+    entries = []
+
+    def flush():
+        commit(entries)
+
+    _local.transaction_entries = (entries, flush)
+    transaction.on_commit(flush, using=using)
+    return entries
+
+
+def record(model, object_id, action, changes, using=None):
+    """
+    Buffer an audit entry. Entries written inside a transaction are stored
+    on commit, entries of a request at its end, all with one bulk insert.
+    """
+    if not changes and action == 'update':
+        return
+    now = timezone.now()
+    entry = AuditEntry(
+                    month=get_month(now),
+                    created=now,
+                    user_id=get_current_user(),
+                    content_type=ContentType.objects.get_for_model(model),
+                    object_id=object_id,
+                    action=action,
+                    changes=encode(changes)
+                    )
+
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block:
+        get_transaction_entries(connection, using).append(entry)
+    elif getattr(_local, 'request_entries', None) is not None:
+        _local.request_entries.append(entry)
+    else:
+        entry.save()
@@ -0,0 +1,18 @@
+from rest_framework import serializers
+
+from .models import AuditEntry
+
+
+class AuditEntrySerializer(serializers.ModelSerializer):
+    model = serializers.SerializerMethodField()
+    changes = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AuditEntry
+        fields = ('id', 'created', 'user', 'model', 'object_id', 'action', 'changes')
+
+    def get_model(self, obj):
+        return '.'.join((obj.content_type.app_label, obj.content_type.model))
+
+    def get_changes(self, obj):
+        return obj.get_changes()
@@ -0,0 +1,68 @@
+from django.apps import apps
+from django.db.models.signals import post_init, post_save, post_delete
+
+from .recorder import record, is_suppressed
+
+# model -> (tracked fields, parent the changes are recorded against, field naming the child)
+TRACKED_MODELS = {
+    'appointment_requests.InsuranceCase': (('status', 'doctor', 'company', 'ref_number'), None, None),
+    'reports.Report': (
+        ('checked', 'visit_price', 'visit_price_doctor', 'type_of_visit', 'city', 'date_of_visit'), None, None
+    ),
+    'reports.ServiceItem': (('quantity', 'cost', 'cost_doctor'), 'report', 'service'),
+}
+
+
+def get_values(instance, fields):
+    values = {}
+    for name in fields:
+        attname = instance._meta.get_field(name).attname
+        # deferred fields are skipped rather than loaded
+        if attname in instance.__dict__:
+            values[name] = instance.__dict__[attname]
+    return values
+
+
+def get_target(instance, parent, key):
+    if parent is None:
+        return type(instance), instance.pk, ''
+    field = instance._meta.get_field(parent)
+    key_field = instance._meta.get_field(key)
+    prefix = '{}:{}.'.format(key, getattr(instance, key_field.attname))
+    return field.related_model, getattr(instance, field.attname), prefix
+
+
+def connect_tracked_models():
+    for label, (fields, parent, key) in TRACKED_MODELS.items():
+        model = apps.get_model(label)
+
+        def snapshot(sender, instance, fields=fields, **kwargs):
+            instance._audit_values = get_values(instance, fields)
+
+        def saved(sender, instance, created, fields=fields, parent=parent, key=key, **kwargs):
+            if is_suppressed():
+                return
+            values = get_values(instance, fields)
+            old = {} if created else getattr(instance, '_audit_values', {})
+            changes = {
+                name: [old.get(name), value]
+                for name, value in values.items()
+                if created or name in old and old[name] != value
+            }
+            instance._audit_values = values
+            model, object_id, prefix = get_target(instance, parent, key)
+            action = 'create' if created and parent is None else 'update'
+            record(model, object_id, action, {prefix + name: change for name, change in changes.items()})
+
+        def deleted(sender, instance, fields=fields, parent=parent, key=key, **kwargs):
+            if is_suppressed():
+                return
+            values = getattr(instance, '_audit_values', None) or get_values(instance, fields)
+            model, object_id, prefix = get_target(instance, parent, key)
+            changes = {prefix + name: [value, None] for name, value in values.items()}
+            record(model, object_id, 'update' if parent is not None else 'delete', changes)
+
+        uid = 'audit:' + label
+        post_init.connect(snapshot, sender=model, weak=False, dispatch_uid=uid)
+        post_save.connect(saved, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=uid)
@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from medical_center.testing import create_city, create_doctor, create_company, create_case, create_report
+from reports.archive import archive_batch
+from reports.models import Report
+from .models import AuditEntry
+
+
+# entries are written on commit, so the tests need real transactions
+class AuditEntryTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.doctor = create_doctor('doctor', create_city())
+        self.report = create_report(create_case(self.doctor, create_company()))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+
+    def get_entries(self, **params):
+        response = self.client.get(reverse('audit-entry-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_query_by_object(self):
+        report = Report.objects.get(pk=self.report.pk)
+        report.visit_price = Decimal('50.00')
+        report.save()
+
+        entries = self.get_entries(model='reports.report', object_id=self.report.pk)
+        self.assertEqual([entry['action'] for entry in entries], ['update', 'create'])
+        self.assertEqual(entries[0]['changes'], {'visit_price': ['0.00', '50.00']})
+
+    def test_unknown_model(self):
+        response = self.client.get(reverse('audit-entry-list'), {'model': 'reports.nothing'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_ids(self):
+        for name in ('object_id', 'user'):
+            response = self.client.get(reverse('audit-entry-list'), {name: 'abc'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(name, response.data)
+        self.assertEqual(self.get_entries(user=self.doctor.user_id), [])
+
+    def test_archiving_is_not_logged_as_delete(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root):
+            archive_batch([self.report.pk])
+
+        actions = list(AuditEntry.objects.filter(object_id=self.report.pk).values_list('action', flat=True))
+        self.assertIn('archive', actions)
+        self.assertNotIn('delete', actions)
@@ -0,0 +1,64 @@
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from rest_framework import viewsets
+from rest_framework import permissions
+from rest_framework.exceptions import ValidationError
+import django_filters.rest_framework
+
+from .models import AuditEntry, get_month
+from .serializers import AuditEntrySerializer
+
+
+class AuditEntryViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = AuditEntrySerializer
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+
+    def get_date(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValidationError({name: 'Use YYYY-MM-DD format.'})
+
+    def get_id(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = AuditEntry.objects.select_related('content_type')
+
+        # restrict to the month range first, it leads every index
+        date_to = self.get_date('date_to') or timezone.localdate()
+        date_from = self.get_date('date_from') or date_to - datetime.timedelta(days=365)
+        queryset = queryset.filter(
+                            month__gte=get_month(date_from),
+                            month__lte=get_month(date_to),
+                            created__date__gte=date_from,
+                            created__date__lte=date_to
+                            )
+
+        if params.get('model'):
+            try:
+                app_label, model = params['model'].lower().split('.')
+                content_type = ContentType.objects.get_by_natural_key(app_label, model)
+            except (ValueError, ContentType.DoesNotExist):
+                raise ValidationError({'model': 'Unknown model.'})
+            queryset = queryset.filter(content_type=content_type)
+        object_id = self.get_id('object_id')
+        if object_id is not None:
+            queryset = queryset.filter(object_id=object_id)
+        user = self.get_id('user')
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        return queryset
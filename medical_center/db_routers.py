@@ -0,0 +1,63 @@
+import random
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = Local()
+
+# app label of the model used by django.core.cache.backends.db
+CACHE_APP_LABEL = 'django_cache'
+
+
+def pin_primary():
+    _state.pinned = True
+
+
+def unpin_primary():
+    _state.pinned = False
+    _state.wrote = False
+
+
+def is_primary_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def has_written():
+    return getattr(_state, 'wrote', False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to one of DATABASE_REPLICAS and writes to the primary.
+    Once something has been written, reads of the same request (thread)
+    stay on the primary so they see their own writes.
+    The database cache (throttling, coalescing) always uses the primary
+    and does not pin the request.
+    """
+
+    def get_replicas(self):
+        return getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self.get_replicas()
+        if (not replicas
+                or model._meta.app_label == CACHE_APP_LABEL
+                or is_primary_pinned()
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        pin_primary()
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self.get_replicas()}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import connections
+
+from .db_routers import pin_primary, unpin_primary, has_written
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def close_unusable_connections():
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+class PrimaryPinningMiddleware:
+    """
+    Pins unsafe requests, and requests that follow a recent write of the same
+    client, to the primary database. Persistent connections are health
+    checked before they are reused.
+    """
+    cookie_name = 'db_pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if getattr(settings, 'DATABASE_HEALTH_CHECKS', True):
+            close_unusable_connections()
+
+        unpin_primary()
+        if request.method not in SAFE_METHODS or self.cookie_name in request.COOKIES:
+            pin_primary()
+
+        try:
+            response = self.get_response(request)
+            wrote = has_written()
+        finally:
+            unpin_primary()
+
+        if wrote:
+            response.set_cookie(
+                            self.cookie_name,
+                            '1',
+                            max_age=getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5),
+                            httponly=True
+                            )
+        return response
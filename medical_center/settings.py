@@ -1,15 +1,24 @@
 import os
 import datetime
 
-from .secret_data import SECRET_KEY, TIME_ZONE, DEBUG
-from .secret_data import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, ALLOWED_HOST, DB_PORT
-from .secret_data import FRONTEND_URL
+
+def get_secret(name, env_name=None, default=None):
+    # secret_data is only imported for values missing from the environment
+    value = os.environ.get(env_name or name)
+    if value is not None:
+        return value
+    try:
+        from . import secret_data
+    except ImportError:
+        return default
+    return getattr(secret_data, name, default)
+
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', SECRET_KEY)
+SECRET_KEY = get_secret('SECRET_KEY', 'DJANGO_SECRET_KEY')
 
-DEBUG = bool(os.environ.get('DJANGO_DEBUG', DEBUG))
+DEBUG = bool(get_secret('DEBUG', 'DJANGO_DEBUG', False))
 
 if not DEBUG:
 
@@ -26,7 +35,7 @@ if not DEBUG:
     SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 ALLOWED_HOSTS = [
-                os.environ.get('ALLOWED_HOST', ALLOWED_HOST)
+                get_secret('ALLOWED_HOST', default='localhost')
 ]
 
 
@@ -44,6 +53,8 @@ INSTALLED_APPS = [
     'profiles.apps.ProfilesConfig',
     'insurance_companies.apps.InsuranceCompaniesConfig',
     'reports.apps.ReportsConfig',
+    'analytics.apps.AnalyticsConfig',
+    'audit.apps.AuditConfig',
     'rest_framework',
     'rest_framework_jwt',
     'corsheaders',
@@ -52,11 +63,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'medical_center.middleware.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'audit.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,7 +80,7 @@ if DEBUG:
     CORS_ORIGIN_ALLOW_ALL = True
 else:
     CORS_ORIGIN_WHITELIST = [
-                        FRONTEND_URL,
+                        get_secret('FRONTEND_URL'),
     ]
 
 REST_FRAMEWORK = {
@@ -76,17 +89,52 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'profiles.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'medical_center.throttling.TokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'analytics': os.environ.get('THROTTLE_ANALYTICS', '30/min'),
+        'nearest': os.environ.get('THROTTLE_NEAREST', '60/min'),
+        'autofill': os.environ.get('THROTTLE_AUTOFILL', '30/min'),
+        'import': os.environ.get('THROTTLE_IMPORT', '20/hour'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
 }
 
+# Token buckets and coalesced results are per process unless they are kept
+# in the database (run createcachetable once)
+if os.environ.get('THROTTLE_CACHE') == 'database':
+    CACHES['throttle'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'throttle_cache',
+    }
+    THROTTLE_CACHE = 'throttle'
+else:
+    THROTTLE_CACHE = 'default'
+
+# Seconds identical requests wait for a running computation, and keep its result
+COALESCE_TIMEOUT = 30
+
+COALESCE_RESULT_TTL = 5
+
 JWT_AUTH = {
     'JWT_ALLOW_REFRESH': True,
     'JWT_EXPIRATION_DELTA': datetime.timedelta(seconds=600),
+    'JWT_PAYLOAD_HANDLER': 'profiles.authentication.jwt_payload_handler',
 }
 
+# Seconds an authenticated user and its permissions are kept in process memory
+JWT_AUTH_USER_CACHE_TTL = 60
+
 
 ROOT_URLCONF = 'medical_center.urls'
 
@@ -112,22 +160,47 @@ WSGI_APPLICATION = 'medical_center.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.mysql')
+
 DATABASES = {
     'default': {
-        'ENGINE'  : 'django.db.backends.mysql',
-        'NAME'    : os.environ.get('DB_NAME', DB_NAME),
-        'USER'    : os.environ.get('DB_USER', DB_USER),
-        'PASSWORD': os.environ.get('DB_PASSWORD', DB_PASSWORD),
-        'HOST'    : os.environ.get('DB_HOST', DB_HOST),
-        'PORT'    : os.environ.get('DB_PORT', DB_PORT),
-        'OPTIONS' : {
-            'autocommit': True,
-            'charset': 'utf8',
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
-        }
+        'ENGINE'  : DB_ENGINE,
+        'NAME'    : get_secret('DB_NAME'),
+        'USER'    : get_secret('DB_USER', default=''),
+        'PASSWORD': get_secret('DB_PASSWORD', default=''),
+        'HOST'    : get_secret('DB_HOST', default=''),
+        'PORT'    : get_secret('DB_PORT', default=''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'OPTIONS' : {},
     }
 }
 
+if DB_ENGINE == 'django.db.backends.mysql':
+    DATABASES['default']['OPTIONS'] = {
+        'autocommit': True,
+        'charset': 'utf8',
+        'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
+    }
+
+# Comma separated replica hosts (or database files for SQLite)
+DATABASE_REPLICAS = []
+
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    alias = 'replica_{}'.format(index)
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE == 'django.db.backends.sqlite3':
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        DATABASES[alias]['HOST'] = replica.strip()
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['medical_center.db_routers.PrimaryReplicaRouter']
+
+# Reads stay on the primary for this long after a client's write
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+
+DATABASE_HEALTH_CHECKS = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -170,7 +243,7 @@ USE_TZ = True
 
 DATE_FORMAT = 'j E Y'
 
-TIME_ZONE = os.environ.get('TIME_ZONE', TIME_ZONE)
+TIME_ZONE = get_secret('TIME_ZONE', default='UTC')
 
 TIME_FORMAT = 'H:i'
 
@@ -181,3 +254,19 @@ DATETIME_FORMAT = 'j E Y H:i'
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+MEDIA_URL = '/media/'
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# 'nginx' (X-Accel-Redirect), 'apache' (X-Sendfile) or empty to stream files through Django
+SENDFILE_BACKEND = os.environ.get('SENDFILE_BACKEND', '')
+
+SENDFILE_URL = os.environ.get('SENDFILE_URL', '/protected/')
+
+
+# Reports archive
+
+REPORTS_ARCHIVE_AGE_DAYS = int(os.environ.get('REPORTS_ARCHIVE_AGE_DAYS', 730))
+
+REPORTS_ARCHIVE_DIR = 'ARCHIVE'
@@ -0,0 +1,66 @@
+"""
+Helpers building the smallest object graph the tests need.
+"""
+import datetime
+
+from django.contrib.auth.models import User, Permission
+from django.utils import timezone
+
+from territories.models import Country, Region, District, City
+from profiles.models import Profile
+from insurance_companies.models import PriceGroup, Company
+from appointment_requests.models import InsuranceCase
+from reports.models import TypeOfVisit, Report
+
+
+def create_city(name='Madrid', country='Spain', latitude=None, longitude=None):
+    country, _ = Country.objects.get_or_create(name=country)
+    region, _ = Region.objects.get_or_create(name='Region', country=country)
+    district, _ = District.objects.get_or_create(name='District', region=region)
+    return City.objects.create(name=name, district=district, latitude=latitude, longitude=longitude)
+
+
+def create_doctor(username, city, initials='AB', permissions=(), **kwargs):
+    user = User.objects.create_user(username, password='password', **kwargs)
+    for codename in permissions:
+        user.user_permissions.add(Permission.objects.get(codename=codename))
+    return Profile.objects.create(user=user, city=city, num_col='1', initials=initials)
+
+
+def create_company(name='Company', initials='CO'):
+    price_group, _ = PriceGroup.objects.get_or_create(name='Default')
+    return Company.objects.create(name=name, initials=initials, price_group=price_group)
+
+
+def create_case(doctor, company, ref_number=1, date_time=None, **kwargs):
+    return InsuranceCase.objects.create(
+                                    doctor=doctor,
+                                    sender=doctor,
+                                    company=company,
+                                    ref_number=ref_number,
+                                    date_time=date_time or timezone.now(),
+                                    message='Fever and cough',
+                                    **kwargs
+                                    )
+
+
+def create_report(case, type_of_visit=None, date_of_visit=None, **kwargs):
+    city = case.doctor.city
+    if type_of_visit is None:
+        type_of_visit, _ = TypeOfVisit.objects.get_or_create(
+                                                    name='Visit',
+                                                    country=city.district.region.country,
+                                                    defaults={'initial': 'V'}
+                                                    )
+    values = {
+        'company_ref_number': 'REF{}'.format(case.ref_number),
+        'patients_first_name': 'John',
+        'patients_last_name': 'Smith',
+        'patients_date_of_birth': datetime.date(1980, 1, 1),
+        'date_of_visit': date_of_visit or datetime.date.today(),
+        'cause_of_visit': 'Fever',
+        'checkup': 'Normal',
+        'prescription': 'Rest',
+    }
+    values.update(kwargs)
+    return Report.objects.create(case=case, type_of_visit=type_of_visit, city=city, **values)
@@ -0,0 +1,203 @@
+import threading
+from unittest import skipUnless, mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from territories.models import Country
+
+from .db_routers import PrimaryReplicaRouter, pin_primary, unpin_primary
+from .middleware import PrimaryPinningMiddleware
+from .throttling import TokenBucketThrottle, coalesce
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        unpin_primary()
+
+    def tearDown(self):
+        unpin_primary()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Country), 'replica')
+
+    def test_writes_go_to_primary_and_pin(self):
+        self.assertEqual(self.router.db_for_write(Country), 'default')
+        self.assertEqual(self.router.db_for_read(Country), 'default')
+
+    def test_pinned_reads_go_to_primary(self):
+        pin_primary()
+        self.assertEqual(self.router.db_for_read(Country), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Country), 'default')
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'territories'))
+        self.assertFalse(self.router.allow_migrate('replica', 'territories'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_HEALTH_CHECKS=False)
+class PrimaryPinningMiddlewareTest(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+
+    def test_unsafe_request_is_pinned_and_sets_cookie(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Country))
+            self.router.db_for_write(Country)
+            return HttpResponse()
+
+        response = PrimaryPinningMiddleware(view)(self.factory.post('/'))
+        self.assertEqual(reads, ['default'])
+        self.assertIn(PrimaryPinningMiddleware.cookie_name, response.cookies)
+        self.assertEqual(self.router.db_for_read(Country), 'replica')
+
+    def test_safe_request_reads_replica(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Country))
+            return HttpResponse()
+
+        response = PrimaryPinningMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(reads, ['replica'])
+        self.assertNotIn(PrimaryPinningMiddleware.cookie_name, response.cookies)
+
+    def test_cookie_pins_following_reads(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Country))
+            return HttpResponse()
+
+        request = self.factory.get('/')
+        request.COOKIES[PrimaryPinningMiddleware.cookie_name] = '1'
+        PrimaryPinningMiddleware(view)(request)
+        self.assertEqual(reads, ['default'])
+
+
+class TokenBucketThrottleTest(SimpleTestCase):
+
+    class View:
+        throttle_scope = 'test'
+
+    def setUp(self):
+        cache.clear()
+        self.now = 0
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+
+    def get_throttle(self):
+        throttle = TokenBucketThrottle()
+        throttle.THROTTLE_RATES = {'test': '2/min'}
+        throttle.timer = lambda: self.now
+        return throttle
+
+    def allow(self):
+        return self.get_throttle().allow_request(self.request, self.View())
+
+    def test_burst_then_refill(self):
+        self.assertTrue(self.allow())
+        self.assertTrue(self.allow())
+        throttle = self.get_throttle()
+        self.assertFalse(throttle.allow_request(self.request, self.View()))
+        self.assertEqual(throttle.wait(), 30)
+        self.now = 30
+        self.assertTrue(self.allow())
+        self.assertFalse(self.allow())
+
+    def test_view_without_scope(self):
+        view = self.View()
+        view.throttle_scope = None
+        for _ in range(5):
+            self.assertTrue(self.get_throttle().allow_request(self.request, view))
+
+
+class CoalesceTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_calls_share_result(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        leader = threading.Thread(target=lambda: results.append(coalesce('key', compute)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(coalesce('key', compute)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(results, [42, 42])
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_are_not_cached(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            coalesce('error', fail)
+        self.assertEqual(coalesce('error', lambda: 1), 1)
+
+
+class ThrottledEndpointTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.country = Country.objects.create(name='Spain')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+
+    def test_scope_on_action_is_throttled(self):
+        url = reverse('city-nearest')
+        params = {'latitude': 40.4, 'longitude': -3.7, 'country': self.country.pk}
+        with mock.patch.object(TokenBucketThrottle, 'THROTTLE_RATES', {'nearest': '1/min'}):
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+            self.assertEqual(self.client.get(url, params).status_code, 429)
+
+
+# DB_ENGINE=django.db.backends.sqlite3 DB_NAME=primary.sqlite3 DB_REPLICAS=replica.sqlite3 ./manage.py test
+@skipUnless(settings.DATABASE_REPLICAS, 'No replica databases configured')
+class ReplicaDatabaseTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        unpin_primary()
+
+    def tearDown(self):
+        unpin_primary()
+
+    def test_read_after_write(self):
+        Country.objects.create(name='Spain')
+        self.assertEqual(Country.objects.get(name='Spain')._state.db, 'default')
+
+    def test_read_from_replica(self):
+        country = Country.objects.using('default').create(name='Italy')
+        unpin_primary()
+        replica_country = Country.objects.get(pk=country.pk)
+        self.assertIn(replica_country._state.db, settings.DATABASE_REPLICAS)
@@ -0,0 +1,153 @@
+import json
+import time
+import hashlib
+import functools
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+
+class TokenBucketThrottle(ScopedRateThrottle):
+    """
+    Token bucket per user (or client address) and view throttle_scope.
+    A rate of '30/min' allows bursts of 30 requests and refills one token
+    every two seconds. Views without a throttle_scope are not throttled.
+    """
+
+    @property
+    def cache(self):
+        return get_cache()
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        tokens, updated = self.cache.get(self.key, (self.num_requests, self.now))
+        self.tokens = min(self.num_requests, tokens + (self.now - updated) * self.num_requests / self.duration)
+        if self.tokens < 1:
+            return False
+        self.cache.set(self.key, (self.tokens - 1, self.now), self.duration)
+        return True
+
+    def wait(self):
+        return (1 - self.tokens) * self.duration / self.num_requests
+
+
+class _Call:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _compute_shared(key, compute, timeout):
+    cache = get_cache()
+    result_key = 'coalesce:result:{}'.format(key)
+    lock_key = 'coalesce:lock:{}'.format(key)
+
+    result = cache.get(result_key)
+    if result is not None:
+        return result
+
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, True, timeout):
+        # another process is computing, wait for its result
+        if time.monotonic() > deadline:
+            return compute()
+        time.sleep(0.1)
+        result = cache.get(result_key)
+        if result is not None:
+            return result
+
+    try:
+        result = compute()
+        cache.set(result_key, result, getattr(settings, 'COALESCE_RESULT_TTL', 5))
+        return result
+    finally:
+        cache.delete(lock_key)
+
+
+def coalesce(key, compute, timeout=None):
+    """
+    Call compute() once for concurrent callers with the same key.
+    Threads of this process wait for the running call; other processes
+    wait on a lock in the throttle cache and read the shared result, which
+    is kept for COALESCE_RESULT_TTL seconds.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'COALESCE_TIMEOUT', 30)
+
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.event.wait(timeout):
+            return compute()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _compute_shared(key, compute, timeout)
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.event.set()
+
+
+def get_request_key(view, request, *args, **kwargs):
+    params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+    key = [
+        view.__class__.__module__,
+        view.__class__.__name__,
+        getattr(view, 'action', None),
+        request.user.pk,
+        request.path,
+        params,
+        args,
+        kwargs,
+    ]
+    return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+
+
+def coalesced(method):
+    """
+    Decorator for view handlers: identical requests of the same user that
+    run at the same time share one computation and its response.
+    """
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        def compute():
+            response = method(view, request, *args, **kwargs)
+            return response.data, response.status_code
+
+        data, status = coalesce(get_request_key(view, request, *args, **kwargs), compute)
+        return Response(data, status=status)
+    return wrapper
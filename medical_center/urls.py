@@ -3,5 +3,10 @@ from django.urls import path, include
 
 urlpatterns = [
     path('territories/', include('territories.urls')),
+    path('profiles/', include('profiles.urls')),
+    path('appointment_requests/', include('appointment_requests.urls')),
+    path('reports/', include('reports.urls')),
+    path('analytics/', include('analytics.urls')),
+    path('audit/', include('audit.urls')),
     path('admin_site/', admin.site.urls),
 ]
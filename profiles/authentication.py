@@ -0,0 +1,107 @@
+import copy
+import time
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.utils import jwt_payload_handler as default_jwt_payload_handler
+
+from .models import Profile
+
+
+def get_cache_ttl():
+    return getattr(settings, 'JWT_AUTH_USER_CACHE_TTL', 60)
+
+
+def get_permission_version(user_id):
+    # read from the primary on every request, a per-process cache would
+    # keep serving revoked permissions after a bump in another worker
+    return (
+        Profile.objects.using(DEFAULT_DB_ALIAS)
+        .filter(user=user_id)
+        .values_list('permission_version', flat=True)
+        .first()
+    ) or 0
+
+
+class UserCache:
+    """
+    Short-lived in-process cache of authenticated users keyed by id and
+    permission version, so a version bump invalidates it everywhere.
+    Every request gets its own deep copy, related objects included, so
+    changes made while handling one never leak into the cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def get(self, user_id, version):
+        with self.lock:
+            entry = self.users.get(user_id)
+        if entry is None:
+            return None
+        expires, cached_version, user = entry
+        if cached_version != version or expires < time.monotonic():
+            return None
+        return copy.deepcopy(user)
+
+    def set(self, user_id, version, user):
+        with self.lock:
+            self.users[user_id] = (time.monotonic() + get_cache_ttl(), version, copy.deepcopy(user))
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+
+user_cache = UserCache()
+
+
+def jwt_payload_handler(user):
+    payload = default_jwt_payload_handler(user)
+    profile = (
+            Profile.objects.filter(user=user)
+            .select_related('city__district__region')
+            .first()
+            )
+    payload['profile_id'] = profile.pk if profile else None
+    payload['country_id'] = profile.city.district.region.country_id if profile and profile.city else None
+    payload['perm_version'] = profile.permission_version if profile else 0
+    return payload
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    Resolves the token user from the in-process cache. The user is loaded
+    with the profile and its territory chain, and its permission set is
+    computed once, so DjangoModelPermissions checks do not query.
+    """
+
+    def authenticate_credentials(self, payload):
+        user_id = payload.get('user_id')
+        if user_id is None:
+            return super(CachedJSONWebTokenAuthentication, self).authenticate_credentials(payload)
+
+        # a token issued after a bump this process has not seen yet is never served stale permissions
+        version = max(get_permission_version(user_id), payload.get('perm_version', 0))
+        user = user_cache.get(user_id, version)
+        if user is None:
+            try:
+                user = (
+                    get_user_model().objects
+                    .select_related('profile__city__district__region__country')
+                    .get(pk=user_id)
+                )
+            except get_user_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+            user.get_all_permissions()
+            user_cache.set(user_id, version, user)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User account is disabled.'))
+        return user
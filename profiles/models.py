@@ -1,10 +1,18 @@
-from django.db import models
-from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.shortcuts import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 
 
+REPORT_TEMPLATES_CACHE_KEY = 'profiles:report_templates:{}'
+REPORT_TEMPLATES_CACHE_TIMEOUT = 60 * 60
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name=_("User"))
     city = models.ForeignKey('territories.City', on_delete=models.SET_NULL, null=True, verbose_name=_("City"))
@@ -13,11 +21,17 @@ class Profile(models.Model):
     initials = models.CharField(max_length=5, verbose_name=_("Initials"), blank=True)
     viber_id = models.CharField(max_length=100, verbose_name=_("Viber id"), blank=True,)
     is_owner = models.BooleanField(default=False, verbose_name=_("Owner"))
+    permission_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = _('Profile')
         verbose_name_plural = _('Profiles')
 
+    @staticmethod
+    def bump_permission_version(user_ids):
+        user_ids = list(user_ids)
+        Profile.objects.filter(user__in=user_ids).update(permission_version=F('permission_version') + 1)
+
     def validate_unique(self, *args, **kwargs):
         super(Profile, self).validate_unique(*args, **kwargs)
 
@@ -76,9 +90,63 @@ class ReportAutofillTemplate(models.Model):
         verbose_name = _('Report autofill template')
         verbose_name_plural = _('Report autofill templates')
 
+    def __str__(self):
+        return self.name
+
     def get_update_url(self):
         return reverse('profile_template_update_url', kwargs={'pk': self.pk})
 
+    def apply_to_reports(self, report_ids):
+        """
+        Fill the given unchecked reports of the template's doctor in one transaction.
+        Returns the list of updated reports.
+        """
+        from reports.models import Report
+
+        disease_ids = [disease.pk for disease in self.diagnosis_template.all()]
+        fields = ['cause_of_visit', 'checkup', 'additional_checkup', 'prescription']
+        through = Report.diagnosis.through
+
+        with transaction.atomic():
+            reports = list(
+                        Report.objects.select_for_update()
+                        .filter(
+                            pk__in=report_ids,
+                            checked=False,
+                            case__doctor=self.profile_id,
+                            city__district__region__country=self.country_id
+                            )
+                        .order_by('pk')
+                        )
+            for report in reports:
+                report.cause_of_visit = self.cause_of_visit_template
+                report.checkup = self.checkup_template
+                report.additional_checkup = self.additional_checkup_template
+                report.prescription = self.prescription_template
+                report.version = F('version') + 1
+            Report.objects.bulk_update(reports, fields + ['version'])
+
+            through.objects.filter(report__in=reports).delete()
+            through.objects.bulk_create([
+                through(report_id=report.pk, disease_id=disease_id)
+                for report in reports
+                for disease_id in disease_ids
+            ])
+        return reports
+
+    @classmethod
+    def get_cached_list(cls, profile):
+        key = REPORT_TEMPLATES_CACHE_KEY.format(profile.pk)
+        templates = cache.get(key)
+        if templates is None:
+            templates = list(
+                        cls.objects.filter(profile=profile)
+                        .prefetch_related('diagnosis_template')
+                        .order_by('name')
+                        )
+            cache.set(key, templates, REPORT_TEMPLATES_CACHE_TIMEOUT)
+        return templates
+
 
 class DoctorDistrict(models.Model):
     doctor = models.ForeignKey(Profile, on_delete=models.CASCADE, verbose_name=_("Doctor"))
@@ -111,3 +179,88 @@ class DoctorDistrictVisitPrice(models.Model):
     def __str__(self):
         return ' - '.join((str(self.doctor_district), str(self.type_of_visit)))
 
+
+@receiver(post_save, sender=ReportAutofillTemplate)
+@receiver(post_delete, sender=ReportAutofillTemplate)
+def report_template_cache_invalidate(sender, instance, **kwargs):
+    cache.delete(REPORT_TEMPLATES_CACHE_KEY.format(instance.profile_id))
+
+
+@receiver(m2m_changed, sender=ReportAutofillTemplate.diagnosis_template.through)
+def report_template_diagnosis_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        cache.delete(REPORT_TEMPLATES_CACHE_KEY.format(instance.profile_id))
+        return
+    if action == 'post_clear':
+        profile_ids = Profile.objects.values_list('pk', flat=True)
+    else:
+        profile_ids = (
+                    ReportAutofillTemplate.objects
+                    .filter(pk__in=pk_set or ())
+                    .values_list('profile_id', flat=True)
+                    )
+    cache.delete_many([REPORT_TEMPLATES_CACHE_KEY.format(pk) for pk in set(profile_ids)])
+
+
+@receiver(post_save, sender=User)
+def user_permission_version_bump(sender, instance, created, **kwargs):
+    if not created:
+        Profile.bump_permission_version([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+def profile_permission_version_bump(sender, instance, **kwargs):
+    Profile.bump_permission_version([instance.user_id])
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        Profile.bump_permission_version([instance.pk])
+    elif action == 'post_clear':
+        Profile.bump_permission_version(User.objects.values_list('pk', flat=True))
+    else:
+        Profile.bump_permission_version(pk_set or ())
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        users = User.objects.filter(groups=instance)
+    else:
+        users = User.objects.filter(groups__isnull=False)
+    Profile.bump_permission_version(users.values_list('pk', flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=DoctorDistrict.cities.through)
+def doctor_district_cities_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    from territories.spatial import coverage_changed
+
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        country_ids = [instance.country_id]
+        city_ids = None if action == 'post_clear' else pk_set
+    elif action == 'post_clear':
+        country_ids = [instance.district.region.country_id]
+        city_ids = [instance.pk]
+    else:
+        country_ids = DoctorDistrict.objects.filter(pk__in=pk_set or ()).values_list('country', flat=True)
+        city_ids = [instance.pk]
+    for country_id in set(country_ids):
+        transaction.on_commit(lambda country_id=country_id: coverage_changed(country_id, city_ids))
+
+
+@receiver(post_save, sender=DoctorDistrict)
+@receiver(post_delete, sender=DoctorDistrict)
+def doctor_district_changed(sender, instance, **kwargs):
+    from territories.spatial import coverage_changed
+
+    transaction.on_commit(lambda: coverage_changed(instance.country_id))
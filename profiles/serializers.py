@@ -0,0 +1,19 @@
+from rest_framework import serializers
+
+from .models import ReportAutofillTemplate
+
+
+class ReportAutofillTemplateSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ReportAutofillTemplate
+        fields = '__all__'
+        read_only_fields = ('profile',)
+
+
+class ReportAutofillApplySerializer(serializers.Serializer):
+    reports = serializers.ListField(
+                                child=serializers.IntegerField(min_value=1),
+                                allow_empty=False,
+                                max_length=500
+                                )
@@ -1,3 +1,133 @@
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.db.models import F
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from medical_center.testing import create_city, create_doctor, create_company, create_case, create_report
+from reports.models import Disease, Report
+from .authentication import CachedJSONWebTokenAuthentication, user_cache
+from .models import Profile, ReportAutofillTemplate
+
+
+class ReportAutofillApplyTest(TestCase):
+
+    def setUp(self):
+        city = create_city()
+        self.doctor = create_doctor('doctor', city, permissions=['add_reportautofilltemplate', 'change_report'])
+        other = create_doctor('other', city, initials='OT')
+        company = create_company()
+        self.disease = Disease.objects.create(name='Flu', country=city.district.region.country)
+        self.template = ReportAutofillTemplate.objects.create(
+                                                        profile=self.doctor,
+                                                        country=city.district.region.country,
+                                                        name='Flu',
+                                                        checkup_template='Throat is red',
+                                                        prescription_template='Paracetamol'
+                                                        )
+        self.template.diagnosis_template.add(self.disease)
+        self.report = create_report(create_case(self.doctor, company, 1))
+        self.checked = create_report(create_case(self.doctor, company, 2), checked=True)
+        self.foreign = create_report(create_case(other, company, 3))
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def test_retrieve(self):
+        response = self.client.get(reverse('report-template-detail', args=[self.template.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Flu')
+
+    def test_apply(self):
+        response = self.client.post(
+                                reverse('report-template-apply', args=[self.template.pk]),
+                                {'reports': [self.report.pk, self.checked.pk, self.foreign.pk]},
+                                format='json'
+                                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], [self.report.pk])
+        self.assertEqual(response.data['skipped'], sorted([self.checked.pk, self.foreign.pk]))
+
+        report = Report.objects.get(pk=self.report.pk)
+        self.assertEqual(report.checkup, 'Throat is red')
+        self.assertEqual(report.prescription, 'Paracetamol')
+        self.assertEqual(report.version, self.report.version + 1)
+        self.assertEqual(list(report.diagnosis.all()), [self.disease])
+        self.assertEqual(Report.objects.get(pk=self.checked.pk).checkup, 'Normal')
+
+    def test_apply_requires_permission(self):
+        self.client.force_authenticate(create_doctor('reader', self.doctor.city, initials='RD').user)
+        response = self.client.post(
+                                reverse('report-template-apply', args=[self.template.pk]),
+                                {'reports': [self.report.pk]},
+                                format='json'
+                                )
+        self.assertEqual(response.status_code, 403)
+
+    def test_apply_requires_report_permission(self):
+        writer = create_doctor('writer', self.doctor.city, initials='WR', permissions=['add_reportautofilltemplate'])
+        self.template.profile = writer
+        self.template.save()
+        self.client.force_authenticate(writer.user)
+        response = self.client.post(
+                                reverse('report-template-apply', args=[self.template.pk]),
+                                {'reports': [self.report.pk]},
+                                format='json'
+                                )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Report.objects.get(pk=self.report.pk).checkup, 'Normal')
+
+
+class CachedAuthenticationTest(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        cache.clear()
+        self.doctor = create_doctor('doctor', create_city())
+        self.authentication = CachedJSONWebTokenAuthentication()
+
+    def tearDown(self):
+        user_cache.clear()
+
+    def authenticate(self):
+        return self.authentication.authenticate_credentials({'user_id': self.doctor.user_id, 'perm_version': 0})
+
+    def test_user_is_cached(self):
+        self.authenticate()
+        # only the permission version is read
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+            self.assertEqual(user.profile.city.district.region.country.name, 'Spain')
+            self.assertFalse(user.has_perm('reports.change_report'))
+
+    def test_requests_get_independent_copies(self):
+        user = self.authenticate()
+        user.profile.initials = 'ZZ'
+        user.profile.city.name = 'Changed'
+        user.get_all_permissions().add('reports.delete_report')
+
+        user = self.authenticate()
+        self.assertEqual(user.profile.initials, 'AB')
+        self.assertEqual(user.profile.city.name, 'Madrid')
+        self.assertFalse(user.has_perm('reports.delete_report'))
+
+    def test_permission_change_invalidates(self):
+        self.assertFalse(self.authenticate().has_perm('reports.change_report'))
+        self.doctor.user.user_permissions.add(Permission.objects.get(codename='change_report'))
+        self.assertTrue(self.authenticate().has_perm('reports.change_report'))
+
+    def test_deactivated_user(self):
+        self.authenticate()
+        User.objects.filter(pk=self.doctor.user_id).update(is_active=False)
+        Profile.bump_permission_version([self.doctor.user_id])
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_bump_from_another_process(self):
+        self.authenticate()
+        # another worker bumps the version without touching this process' caches
+        User.objects.filter(pk=self.doctor.user_id).update(is_active=False)
+        Profile.objects.filter(pk=self.doctor.pk).update(permission_version=F('permission_version') + 1)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
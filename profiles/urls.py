@@ -0,0 +1,7 @@
+from rest_framework.routers import DefaultRouter
+from .views import ReportAutofillTemplateViewSet
+
+router = DefaultRouter()
+router.register(r'report-templates', ReportAutofillTemplateViewSet, basename='report-template')
+
+urlpatterns = router.urls
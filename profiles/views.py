@@ -1,3 +1,50 @@
-from django.shortcuts import render
+from rest_framework import viewsets
+from rest_framework import permissions
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.response import Response
+import django_filters.rest_framework
 
-# Create your views here.
+from .models import ReportAutofillTemplate
+from .serializers import ReportAutofillTemplateSerializer, ReportAutofillApplySerializer
+
+
+class ReportAutofillTemplateViewSet(viewsets.ModelViewSet):
+    permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    serializer_class = ReportAutofillTemplateSerializer
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+    throttle_scope = None
+
+    def get_queryset(self):
+        return (
+            ReportAutofillTemplate.objects
+            .filter(profile=self.request.user.profile)
+            .prefetch_related('diagnosis_template')
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(profile=self.request.user.profile)
+
+    def list(self, request, *args, **kwargs):
+        templates = ReportAutofillTemplate.get_cached_list(request.user.profile)
+        serializer = self.get_serializer(templates, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'], throttle_scope='autofill')
+    def apply(self, request, pk=None):
+        # the template permissions alone don't allow rewriting reports
+        if not request.user.has_perm('reports.change_report'):
+            raise PermissionDenied()
+        template = self.get_object()
+        serializer = ReportAutofillApplySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = set(serializer.validated_data['reports'])
+
+        reports = template.apply_to_reports(requested)
+        updated = [report.pk for report in reports]
+        return Response({
+            'template': template.pk,
+            'updated': updated,
+            'skipped': sorted(requested.difference(updated)),
+            'diagnosis': [disease.pk for disease in template.diagnosis_template.all()],
+        })
@@ -0,0 +1,150 @@
+import os
+import fcntl
+import shutil
+import zipfile
+import datetime
+import contextlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from audit.recorder import record, suppressed
+from .models import Report, ArchivedReport, ArchivedServiceItem, ArchivedAdditionalImage
+
+
+def get_archive_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'REPORTS_ARCHIVE_DIR', 'ARCHIVE'))
+
+
+def get_bundle_name(date):
+    return date.strftime('%Y-%m') + '.zip'
+
+
+def get_bundle_path(bundle):
+    return os.path.join(get_archive_root(), bundle)
+
+
+@contextlib.contextmanager
+def bundle_lock(bundle):
+    os.makedirs(get_archive_root(), exist_ok=True)
+    with open(get_bundle_path(bundle) + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_bundle_member(bundle, member):
+    with zipfile.ZipFile(get_bundle_path(bundle)) as archive:
+        return archive.read(member)
+
+
+def remove_bundle_members(bundle, prefix):
+    path = get_bundle_path(bundle)
+    if not os.path.exists(path):
+        return
+    with bundle_lock(bundle):
+        with zipfile.ZipFile(path) as source:
+            keep = [info for info in source.infolist() if not info.filename.startswith(prefix)]
+            if len(keep) == len(source.infolist()):
+                return
+            if not keep:
+                os.remove(path)
+                return
+            tmp_path = path + '.tmp'
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as target:
+                for info in keep:
+                    with source.open(info) as src, target.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, path)
+
+
+def write_bundle(bundle, images):
+    with bundle_lock(bundle):
+        with zipfile.ZipFile(get_bundle_path(bundle), 'a', zipfile.ZIP_DEFLATED) as archive:
+            existing = set(archive.namelist())
+            for member, image in images:
+                if member in existing:
+                    continue
+                with image.open('rb') as src, archive.open(member, 'w') as dst:
+                    shutil.copyfileobj(src, dst)
+
+
+def archive_reports(older_than=None, batch_size=100):
+    if older_than is None:
+        older_than = getattr(settings, 'REPORTS_ARCHIVE_AGE_DAYS', 730)
+    cutoff = timezone.localdate() - datetime.timedelta(days=older_than)
+
+    archived = 0
+    while True:
+        ids = list(
+                Report.objects.filter(date_of_visit__lt=cutoff)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+                )
+        if not ids:
+            return archived
+        archived += archive_batch(ids)
+
+
+def archive_batch(report_ids):
+    archived_fields = {field.attname for field in ArchivedReport._meta.concrete_fields}
+    fields = [
+        field.attname for field in Report._meta.concrete_fields
+        if not field.primary_key and field.attname in archived_fields
+    ]
+    diagnosis_through = ArchivedReport.diagnosis.through
+
+    with transaction.atomic():
+        reports = list(
+                    Report.objects.select_for_update()
+                    .filter(pk__in=report_ids)
+                    .prefetch_related('diagnosis', 'service_items', 'additional_images')
+                    )
+
+        archived_reports, service_items, diagnoses, images = [], [], [], []
+        bundles = {}
+        for report in reports:
+            archived_reports.append(ArchivedReport(
+                                                id=report.pk,
+                                                **{name: getattr(report, name) for name in fields}
+                                                ))
+            for disease in report.diagnosis.all():
+                diagnoses.append(diagnosis_through(archivedreport_id=report.pk, disease_id=disease.pk))
+            for item in report.service_items.all():
+                service_items.append(ArchivedServiceItem(
+                                                    report_id=report.pk,
+                                                    service_id=item.service_id,
+                                                    quantity=item.quantity,
+                                                    cost=item.cost,
+                                                    cost_doctor=item.cost_doctor
+                                                    ))
+            bundle = get_bundle_name(report.date_of_visit)
+            for image in report.additional_images.all():
+                member = '/'.join((str(report.pk), os.path.basename(image.image.name)))
+                bundles.setdefault(bundle, []).append((member, image.image))
+                images.append(ArchivedAdditionalImage(
+                                                    id=image.pk,
+                                                    report_id=report.pk,
+                                                    bundle=bundle,
+                                                    member=member,
+                                                    position=image.position,
+                                                    expand=image.expand
+                                                    ))
+
+        for bundle, members in bundles.items():
+            write_bundle(bundle, members)
+
+        ArchivedReport.objects.bulk_create(archived_reports)
+        diagnosis_through.objects.bulk_create(diagnoses)
+        ArchivedServiceItem.objects.bulk_create(service_items)
+        ArchivedAdditionalImage.objects.bulk_create(images)
+        # the live rows are moved, not deleted: log one archive entry per report
+        with suppressed():
+            Report.objects.filter(pk__in=[report.pk for report in reports]).delete()
+        for report in reports:
+            record(Report, report.pk, 'archive', {'bundle': get_bundle_name(report.date_of_visit)})
+
+    return len(reports)
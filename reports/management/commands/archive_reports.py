@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from reports.archive import archive_reports
+
+
+class Command(BaseCommand):
+    # cron jobs skip the system checks, they import the URLconf and image libraries
+    requires_system_checks = False
+    help = 'Move old reports with their services, diagnoses and images to the archive tier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Archive reports older than this many days')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        count = archive_reports(older_than=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Archived {} reports'.format(count)))
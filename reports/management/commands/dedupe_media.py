@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from reports.models import AdditionalImage, ReportTemplate
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Move existing images and report templates to the content-addressed storage'
+
+    def handle(self, *args, **options):
+        moved = 0
+        for model, field_name in ((AdditionalImage, 'image'), (ReportTemplate, 'template')):
+            for instance in model.objects.exclude(**{field_name + '__startswith': 'BLOBS/'}).iterator():
+                field_file = getattr(instance, field_name)
+                old_name = field_file.name
+                try:
+                    with field_file.storage.open(old_name, 'rb') as f:
+                        field_file.save(old_name, f, save=False)
+                except FileNotFoundError:
+                    self.stderr.write('Missing file: {}'.format(old_name))
+                    continue
+                model.objects.filter(pk=instance.pk).update(**{field_name: field_file.name})
+                field_file.storage.delete(old_name)
+                moved += 1
+        self.stdout.write(self.style.SUCCESS('Moved {} files'.format(moved)))
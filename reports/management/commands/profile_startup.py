@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+STARTUP_CODE = 'import django; django.setup()'
+
+# -X importtime misses modules loaded through importlib.import_module, which
+# is how Django loads apps and models. Both import statements and
+# import_module go through _find_and_load, so time the imports there.
+PROFILER = '''
+import sys, json, time
+import importlib._bootstrap as _bootstrap
+
+_find_and_load = _bootstrap._find_and_load
+_children = [0]
+_modules = []
+
+def _timed_find_and_load(name, import_):
+    if name in sys.modules:
+        return _find_and_load(name, import_)
+    _children.append(0)
+    start = time.perf_counter_ns()
+    try:
+        return _find_and_load(name, import_)
+    finally:
+        cumulative = (time.perf_counter_ns() - start) // 1000
+        children = _children.pop()
+        _children[-1] += cumulative
+        _modules.append((name, cumulative - children, cumulative))
+
+_bootstrap._find_and_load = _timed_find_and_load
+_start = time.perf_counter()
+{code}
+_total = time.perf_counter() - _start
+_bootstrap._find_and_load = _find_and_load
+print(json.dumps({{'total': _total, 'modules': _modules, 'loaded': sorted(sys.modules)}}))
+'''
+
+
+def profile_imports(code=STARTUP_CODE):
+    """
+    Run ``code`` in a fresh interpreter and return the wall time in
+    seconds, a list of (module, self us, cumulative us) for the modules it
+    imported and the names of all modules loaded when it finished.
+    """
+    result = subprocess.run(
+                        [sys.executable, '-c', PROFILER.format(code=code)],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        universal_newlines=True,
+                        env=dict(os.environ)
+                        )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = [tuple(module) for module in profile['modules']]
+    return profile['total'], modules, set(profile['loaded'])
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Report the import cost of the modules loaded at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=30)
+        parser.add_argument('--by-package', action='store_true', help='Sum the self time per top level package')
+        parser.add_argument('--code', default=STARTUP_CODE, help='Python code to profile')
+
+    def handle(self, *args, **options):
+        try:
+            total, modules, loaded = profile_imports(options['code'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        if options['by_package']:
+            packages = {}
+            for name, self_time, cumulative in modules:
+                package = name.split('.')[0]
+                packages[package] = packages.get(package, 0) + self_time
+            rows = sorted(((time, name) for name, time in packages.items()), reverse=True)
+            header = 'self ms'
+        else:
+            rows = sorted(((cumulative, name) for name, self_time, cumulative in modules), reverse=True)
+            header = 'cumulative ms'
+
+        self.stdout.write('{:>14}  module'.format(header))
+        for time, name in rows[:options['limit']]:
+            self.stdout.write('{:>14.1f}  {}'.format(time / 1000, name))
+        self.stdout.write(self.style.SUCCESS(
+            'Startup took {:.0f} ms, {} modules imported'.format(total * 1000, len(modules))
+        ))
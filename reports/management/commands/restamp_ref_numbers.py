@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from appointment_requests.models import InsuranceCase
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Recompute the stored ref. numbers of cases and reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Only the cases of this company')
+        parser.add_argument('--doctor', type=int, help='Only the cases of this doctor')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cases = InsuranceCase.objects.all()
+        if options['company']:
+            cases = cases.filter(company=options['company'])
+        if options['doctor']:
+            cases = cases.filter(doctor=options['doctor'])
+        cases.restamp(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Ref. numbers are up to date'))
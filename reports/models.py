@@ -1,14 +1,17 @@
 import os
-import shutil
+import uuid
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.db.models.signals import post_delete, pre_save
-from django.dispatch import receiver
+from django.utils.functional import LazyObject
 from django.utils.translation import ugettext_lazy as _
 
 
+class ReportVersionConflict(Exception):
+    pass
+
+
 def get_image_path(instance, filename):
     return os.path.join(
                     'FILES',
@@ -33,6 +36,30 @@ class OverwriteStorage(FileSystemStorage):
         return self.name
 
 
+class LazyContentAddressedStorage(LazyObject):
+    # the storage module is only imported once a file is actually touched
+    def _setup(self):
+        from .storage import ContentAddressedStorage
+        self._wrapped = ContentAddressedStorage()
+
+    # FileField tests ``storage or default_storage`` when the model is created
+    def __bool__(self):
+        return True
+
+
+class StoredBlob(models.Model):
+    name = models.CharField(max_length=100, primary_key=True, verbose_name=_("Name"))
+    size = models.PositiveIntegerField(default=0, verbose_name=_("Size"))
+    references = models.PositiveIntegerField(default=0, verbose_name=_("References"))
+
+    class Meta:
+        verbose_name = _('Stored blob')
+        verbose_name_plural = _('Stored blobs')
+
+    def __str__(self):
+        return self.name
+
+
 class Disease(models.Model):
     name = models.CharField(max_length=80, unique=True, verbose_name=_("Name"))
     country = models.ForeignKey('territories.Country', on_delete=models.PROTECT, verbose_name=_("Country"))
@@ -65,7 +92,11 @@ class TypeOfVisit(models.Model):
 
 
 class ReportTemplate(models.Model):
-    template = models.FileField(upload_to=get_docxtemplate_path, storage=OverwriteStorage(), verbose_name=_("Template"))
+    template = models.FileField(
+                                upload_to=get_docxtemplate_path,
+                                storage=LazyContentAddressedStorage(),
+                                verbose_name=_("Template")
+                                )
     country = models.OneToOneField('territories.Country', on_delete=models.CASCADE, verbose_name=_("Country"))
 
     class Meta:
@@ -73,7 +104,40 @@ class ReportTemplate(models.Model):
         verbose_name_plural = _('Report templates')
 
 
-class Report(models.Model):
+class ReportQuerySet(models.QuerySet):
+
+    def restamp(self, batch_size=1000):
+        """
+        Recompute the stored full ref. numbers, e.g. after initials changed.
+        Returns the number of updated reports.
+        """
+        reports = (
+                self.select_related('case__company', 'case__doctor', 'type_of_visit')
+                .only(
+                    'full_ref_number', 'type_of_visit__initial',
+                    'case__ref_number', 'case__date_time', 'case__company__initials',
+                    'case__doctor__initials', 'case__doctor__is_foreign_doctor',
+                    )
+                .order_by('pk')
+                )
+        changed = []
+        updated = 0
+        for report in reports.iterator(chunk_size=batch_size):
+            full_ref_number = report.build_full_ref_number()
+            if full_ref_number != report.full_ref_number:
+                report.full_ref_number = full_ref_number
+                changed.append(report)
+            if len(changed) >= batch_size:
+                self.model.objects.bulk_update(changed, ['full_ref_number'])
+                updated += len(changed)
+                changed = []
+        if changed:
+            self.model.objects.bulk_update(changed, ['full_ref_number'])
+            updated += len(changed)
+        return updated
+
+
+class AbstractReport(models.Model):
     company_ref_number = models.CharField(max_length=50, verbose_name=_("Company ref. number"))
     patients_first_name = models.CharField(max_length=50, verbose_name=_("First name"))
     patients_last_name = models.CharField(max_length=50, verbose_name=_("Last name"))
@@ -94,25 +158,26 @@ class Report(models.Model):
     cause_of_visit = models.TextField(max_length=700, verbose_name=_("Cause of visit"))
     checkup = models.TextField(max_length=1200, verbose_name=_("Checkup"))
     additional_checkup = models.TextField(max_length=700, blank=True, verbose_name=_("Additional checkup"))
-    diagnosis = models.ManyToManyField('Disease', related_name='reports', verbose_name=_("Diagnosis"))
     prescription = models.TextField(max_length=700, verbose_name=_("Prescription"))
     checked = models.BooleanField(default=False, verbose_name=_("Is checked"))
-    case = models.OneToOneField(
-                                'appointment_requests.InsuranceCase',
-                                on_delete=models.PROTECT,
-                                related_name='report',
-                                verbose_name=_("Report request")
-                                )
+    full_ref_number = models.CharField(
+                                    max_length=30,
+                                    blank=True,
+                                    db_index=True,
+                                    editable=False,
+                                    verbose_name=_("Full ref. number")
+                                    )
+
+    objects = ReportQuerySet.as_manager()
 
     class Meta:
-        verbose_name = _('Report')
-        verbose_name_plural = _('Reports')
+        abstract = True
 
     def __str__(self):
         return ' '.join((self.patients_last_name, self.patients_first_name, self.get_full_ref_number))
 
     def get_fields(self):
-        return [(field.name, field.value_to_string(self)) for field in Report._meta.fields]
+        return [(field.name, field.value_to_string(self)) for field in self._meta.fields]
 
     @property
     def get_total_price(self):
@@ -136,8 +201,7 @@ class Report(models.Model):
             return total
         return total
 
-    @property
-    def get_full_ref_number(self):
+    def build_full_ref_number(self):
         ref = (self.case.company.initials) + str(self.case.ref_number).zfill(3)
         date_of_request = str(self.case.date_time.strftime("%d%m"))
         if not self.case.doctor.is_foreign_doctor:
@@ -146,17 +210,24 @@ class Report(models.Model):
             info = self.case.doctor.initials
         return '-'.join((ref, date_of_request, info))
 
+    @property
+    def get_full_ref_number(self):
+        return self.full_ref_number or self.build_full_ref_number()
+
     @property
     def get_number_of_visit(self):
         country = self.city.district.region.country
-        reports_queryset = Report.objects.filter(
-            city__district__region__country=country,
-            company_ref_number=self.company_ref_number,
-            patients_first_name=self.patients_first_name,
-            patients_last_name=self.patients_last_name
-        ).order_by('date_of_visit')
-        for index, item in enumerate(reports_queryset, 1):
-            if self.pk == item.pk:
+        lookup = {
+            'city__district__region__country': country,
+            'company_ref_number': self.company_ref_number,
+            'patients_first_name': self.patients_first_name,
+            'patients_last_name': self.patients_last_name,
+        }
+        # archived visits always precede the live ones
+        visits = list(ArchivedReport.objects.filter(**lookup).order_by('date_of_visit').values_list('pk', flat=True))
+        visits += list(Report.objects.filter(**lookup).order_by('date_of_visit').values_list('pk', flat=True))
+        for index, pk in enumerate(visits, 1):
+            if self.pk == pk:
                 return index
 
     @property
@@ -172,6 +243,183 @@ class Report(models.Model):
     get_total_price_doctor.fget.short_description = _('Total price for the doctor')
 
 
+class Report(AbstractReport):
+    diagnosis = models.ManyToManyField('Disease', related_name='reports', verbose_name=_("Diagnosis"))
+    case = models.OneToOneField(
+                                'appointment_requests.InsuranceCase',
+                                on_delete=models.PROTECT,
+                                related_name='report',
+                                verbose_name=_("Report request")
+                                )
+    version = models.PositiveIntegerField(default=0, editable=False, verbose_name=_("Version"))
+
+    class Meta:
+        verbose_name = _('Report')
+        verbose_name_plural = _('Reports')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Report, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_changed_fields(self):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        # deferred fields are missing from loaded, count them once assigned
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and not field.primary_key
+            and field.name != 'version'
+            and (field.attname not in loaded or self.__dict__[field.attname] != loaded[field.attname])
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Existing reports are written with only their changed fields and only
+        if nobody has saved the report since it was loaded, otherwise
+        ReportVersionConflict is raised.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if (loaded is None
+                or not self.full_ref_number
+                or loaded.get('case_id') != self.case_id
+                or loaded.get('type_of_visit_id') != self.type_of_visit_id):
+            self.full_ref_number = self.build_full_ref_number()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'full_ref_number'}
+
+        if self._state.adding or kwargs.get('force_insert'):
+            super(Report, self).save(*args, **kwargs)
+            self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+            return
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = self.get_changed_fields()
+            if update_fields == []:
+                return
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'version'}
+
+        self._expected_version = self.version
+        self.version += 1
+        try:
+            super(Report, self).save(*args, **kwargs)
+        except ReportVersionConflict:
+            self.version = self._expected_version
+            raise
+
+        saved = kwargs.get('update_fields')
+        if hasattr(self, '_loaded_values'):
+            for field in self._meta.concrete_fields:
+                if saved is None or field.name in saved:
+                    self._loaded_values[field.attname] = getattr(self, field.attname)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super(Report, self)._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        updated = super(Report, self)._do_update(
+                                            base_qs.filter(version=expected),
+                                            using,
+                                            pk_val,
+                                            values,
+                                            update_fields,
+                                            forced_update
+                                            )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise ReportVersionConflict(
+                        'Report {} has been changed since version {}'.format(pk_val, expected)
+                        )
+        return updated
+
+    def bump_version(self):
+        """
+        Move the report to the next version without saving its fields,
+        for changes stored in related rows.
+        """
+        updated = Report.objects.filter(pk=self.pk, version=self.version).update(version=models.F('version') + 1)
+        if not updated:
+            raise ReportVersionConflict(
+                        'Report {} has been changed since version {}'.format(self.pk, self.version)
+                        )
+        self.version += 1
+        if hasattr(self, '_loaded_values'):
+            self._loaded_values['version'] = self.version
+
+    def set_diagnosis(self, diseases):
+        """
+        Replace the diagnosis with ``diseases``. A change bumps the report's
+        version, guarded like save().
+        """
+        wanted = {getattr(disease, 'pk', disease) for disease in diseases}
+        if wanted == set(self.diagnosis.values_list('pk', flat=True)):
+            return
+        with transaction.atomic():
+            self.bump_version()
+            self.diagnosis.set(wanted)
+
+    def set_service_items(self, items):
+        """
+        Replace the service items with ``items`` (dicts of ServiceItem fields)
+        touching only the rows that differ. Any change bumps the report's
+        version, guarded like save().
+        """
+        fields = ('quantity', 'cost', 'cost_doctor')
+        existing = {item.service_id: item for item in self.service_items.all()}
+        wanted = {}
+        for data in items:
+            service = data['service']
+            wanted[getattr(service, 'pk', service)] = data
+
+        to_create, to_update, changes = [], [], {}
+        for service_id, data in wanted.items():
+            item = existing.get(service_id)
+            prefix = 'service:{}.'.format(service_id)
+            if item is None:
+                item = ServiceItem(
+                                report=self,
+                                service_id=service_id,
+                                **{name: data[name] for name in fields if name in data}
+                                )
+                to_create.append(item)
+                changes.update({prefix + name: [None, getattr(item, name)] for name in fields})
+                continue
+            changed = False
+            for name in fields:
+                if name in data and getattr(item, name) != data[name]:
+                    changes[prefix + name] = [getattr(item, name), data[name]]
+                    setattr(item, name, data[name])
+                    changed = True
+            if changed:
+                to_update.append(item)
+        to_delete = [item.pk for service_id, item in existing.items() if service_id not in wanted]
+
+        if not (to_delete or to_update or to_create):
+            return
+        with transaction.atomic():
+            self.bump_version()
+            if to_delete:
+                ServiceItem.objects.filter(pk__in=to_delete).delete()
+            if to_update:
+                ServiceItem.objects.bulk_update(to_update, fields)
+            if to_create:
+                ServiceItem.objects.bulk_create(to_create)
+            if changes:
+                # bulk writes send no model signals, log them for the audit trail
+                from audit.recorder import record
+                record(Report, self.pk, 'update', changes)
+        if hasattr(self, '_prefetched_objects_cache'):
+            self._prefetched_objects_cache.pop('service_items', None)
+
+    @property
+    def is_archived(self):
+        return False
+
+
 class AdditionalImage(models.Model):
     report = models.ForeignKey(
                             Report,
@@ -179,15 +427,68 @@ class AdditionalImage(models.Model):
                             related_name='additional_images',
                             verbose_name=_("Report")
                             )
-    image = models.ImageField(upload_to=get_image_path, verbose_name=_("Image"))
+    image = models.ImageField(
+                            upload_to=get_image_path,
+                            storage=LazyContentAddressedStorage(),
+                            verbose_name=_("Image")
+                            )
     position = models.IntegerField(blank=False, verbose_name=_("Position"))
     expand = models.BooleanField(default=False, verbose_name=_("Expand"))
+    checksum = models.CharField(max_length=64, blank=True, db_index=True, verbose_name=_("Checksum"))
 
     class Meta:
         verbose_name = _('Additional Image')
         verbose_name_plural = _('Additional Images')
 
 
+class ImageUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    report = models.ForeignKey(
+                            Report,
+                            on_delete=models.CASCADE,
+                            related_name='image_uploads',
+                            verbose_name=_("Report")
+                            )
+    filename = models.CharField(max_length=100, verbose_name=_("File name"))
+    size = models.PositiveIntegerField(verbose_name=_("Size"))
+    chunk_size = models.PositiveIntegerField(verbose_name=_("Chunk size"))
+    checksum = models.CharField(max_length=64, verbose_name=_("Checksum"))
+    position = models.IntegerField(null=True, blank=True, verbose_name=_("Position"))
+    expand = models.BooleanField(default=False, verbose_name=_("Expand"))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_("Created"))
+
+    class Meta:
+        verbose_name = _('Image upload')
+        verbose_name_plural = _('Image uploads')
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    @property
+    def path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'UPLOADS', str(self.pk) + '.part')
+
+    def get_chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class ImageUploadChunk(models.Model):
+    upload = models.ForeignKey(
+                            ImageUpload,
+                            on_delete=models.CASCADE,
+                            related_name='chunks',
+                            verbose_name=_("Upload")
+                            )
+    index = models.PositiveIntegerField(verbose_name=_("Index"))
+    checksum = models.CharField(max_length=64, verbose_name=_("Checksum"))
+
+    class Meta:
+        unique_together = (('upload', 'index',),)
+        verbose_name = _('Image upload chunk')
+        verbose_name_plural = _('Image upload chunks')
+
+
 class Service(models.Model):
     name = models.CharField(max_length=100, verbose_name=_("Name"))
     country = models.ForeignKey(
@@ -227,37 +528,75 @@ class ServiceItem(models.Model):
         return self.service.name
 
 
-@receiver(post_delete, sender=Report)
-def submission_delete(sender, instance, **kwargs):
-    shutil.rmtree(
-                str(os.path.join(
-                        settings.MEDIA_ROOT,
-                        'FILES',
-                        str(instance.pk)
-                        )
-                    ), ignore_errors=True
-                )
+class ArchivedReport(AbstractReport):
+    id = models.IntegerField(primary_key=True, verbose_name=_("ID"))
+    diagnosis = models.ManyToManyField('Disease', related_name='archived_reports', verbose_name=_("Diagnosis"))
+    case = models.OneToOneField(
+                                'appointment_requests.InsuranceCase',
+                                on_delete=models.PROTECT,
+                                related_name='archived_report',
+                                verbose_name=_("Report request")
+                                )
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Archived at"))
 
+    class Meta:
+        verbose_name = _('Archived report')
+        verbose_name_plural = _('Archived reports')
 
-@receiver(pre_save, sender=AdditionalImage)
-def image_update(sender, instance, **kwargs):
-    if instance.pk:
-        try:
-            old_image = AdditionalImage.objects.get(pk=instance.pk).image
-            os.remove(old_image.path)
-        except AdditionalImage.DoesNotExist:
-            pass
+    @property
+    def is_archived(self):
+        return True
 
 
-@receiver(post_delete, sender=AdditionalImage)
-def image_delete(sender, instance, **kwargs):
-    try:
-        os.remove(instance.image.path)
-    except OSError:
-        pass
+class ArchivedServiceItem(models.Model):
+    report = models.ForeignKey(
+                            ArchivedReport,
+                            related_name='service_items',
+                            on_delete=models.CASCADE,
+                            verbose_name=_("Report")
+                            )
+    service = models.ForeignKey(
+                            Service,
+                            related_name='archived_items',
+                            on_delete=models.PROTECT,
+                            verbose_name=_("Service")
+                            )
+    quantity = models.PositiveIntegerField(default=1, verbose_name=_("Quantity"))
+    cost = models.DecimalField(max_digits=8, decimal_places=2, default=0, verbose_name=_("Cost"))
+    cost_doctor = models.DecimalField(max_digits=8, decimal_places=2, default=0, verbose_name=_("Cost doctor"))
+
+    class Meta:
+        unique_together = (('report', 'service',),)
+        verbose_name = _('Archived service item')
+        verbose_name_plural = _('Archived service items')
+
+    def __str__(self):
+        if self.quantity > 1:
+            return str(self.service.name) + ' [{}]'.format(self.quantity)
+        return self.service.name
+
+
+class ArchivedAdditionalImage(models.Model):
+    id = models.IntegerField(primary_key=True, verbose_name=_("ID"))
+    report = models.ForeignKey(
+                            ArchivedReport,
+                            on_delete=models.CASCADE,
+                            related_name='additional_images',
+                            verbose_name=_("Report")
+                            )
+    bundle = models.CharField(max_length=100, verbose_name=_("Bundle"))
+    member = models.CharField(max_length=255, verbose_name=_("Bundle member"))
+    position = models.IntegerField(blank=False, verbose_name=_("Position"))
+    expand = models.BooleanField(default=False, verbose_name=_("Expand"))
 
+    class Meta:
+        verbose_name = _('Archived additional image')
+        verbose_name_plural = _('Archived additional images')
 
-@receiver(post_delete, sender=ReportTemplate)
-def template_delete(sender, instance, **kwargs):
-    os.remove(instance.template.path)
+    @property
+    def name(self):
+        return os.path.basename(self.member)
 
+    def read(self):
+        from .archive import read_bundle_member
+        return read_bundle_member(self.bundle, self.member)
@@ -0,0 +1,27 @@
+import os
+import mimetypes
+
+from django.conf import settings
+from django.http import HttpResponse, FileResponse
+
+
+def sendfile_response(storage, name, filename=None):
+    """
+    Hand the file over to the front web server when SENDFILE_BACKEND is set,
+    fall back to streaming it through Django otherwise.
+    """
+    filename = filename or os.path.basename(name)
+    backend = getattr(settings, 'SENDFILE_BACKEND', None)
+
+    if backend == 'nginx':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL.rstrip('/') + '/' + name.replace(os.sep, '/')
+    elif backend == 'apache':
+        response = HttpResponse()
+        response['X-Sendfile'] = storage.path(name)
+    else:
+        return FileResponse(storage.open(name, 'rb'), filename=filename)
+
+    response['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response['Content-Disposition'] = 'inline; filename="{}"'.format(filename)
+    return response
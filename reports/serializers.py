@@ -0,0 +1,118 @@
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from .models import Report, ServiceItem, AdditionalImage, ImageUpload
+from .models import ArchivedReport, ArchivedServiceItem, ArchivedAdditionalImage
+
+
+class ServiceItemSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ServiceItem
+        exclude = ('report',)
+        read_only_fields = ('id',)
+
+
+class AdditionalImageSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AdditionalImage
+        fields = ('id', 'url', 'position', 'expand')
+
+    def get_url(self, obj):
+        return reverse(
+                    'report-image',
+                    kwargs={'pk': obj.report_id, 'image_pk': obj.pk},
+                    request=self.context.get('request')
+                    )
+
+
+class ReportSerializer(serializers.ModelSerializer):
+    full_ref_number = serializers.CharField(source='get_full_ref_number', read_only=True)
+    is_archived = serializers.BooleanField(read_only=True)
+    service_items = ServiceItemSerializer(many=True, required=False)
+    additional_images = AdditionalImageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Report
+        fields = '__all__'
+
+    def validate_case(self, value):
+        request = self.context.get('request')
+        if request is not None and not request.user.is_staff and value.doctor_id != request.user.profile.pk:
+            raise serializers.ValidationError('Invalid case.')
+        return value
+
+    def validate_service_items(self, value):
+        services = [item['service'].pk for item in value]
+        if len(services) != len(set(services)):
+            raise serializers.ValidationError('Each service can be added only once.')
+        return value
+
+    def create(self, validated_data):
+        service_items = validated_data.pop('service_items', None)
+        with transaction.atomic():
+            report = super(ReportSerializer, self).create(validated_data)
+            if service_items is not None:
+                report.set_service_items(service_items)
+        return report
+
+    def update(self, instance, validated_data):
+        service_items = validated_data.pop('service_items', None)
+        diagnosis = validated_data.pop('diagnosis', None)
+        with transaction.atomic():
+            report = super(ReportSerializer, self).update(instance, validated_data)
+            if diagnosis is not None:
+                report.set_diagnosis(diagnosis)
+            if service_items is not None:
+                report.set_service_items(service_items)
+        return report
+
+
+class ArchivedServiceItemSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ArchivedServiceItem
+        exclude = ('report',)
+
+
+class ArchivedAdditionalImageSerializer(AdditionalImageSerializer):
+
+    class Meta:
+        model = ArchivedAdditionalImage
+        fields = ('id', 'url', 'position', 'expand')
+
+
+class ArchivedReportSerializer(serializers.ModelSerializer):
+    full_ref_number = serializers.CharField(source='get_full_ref_number', read_only=True)
+    is_archived = serializers.BooleanField(read_only=True)
+    service_items = ArchivedServiceItemSerializer(many=True, read_only=True)
+    additional_images = ArchivedAdditionalImageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ArchivedReport
+        exclude = ('archived_at',)
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+    chunk_size = serializers.IntegerField(min_value=64 * 1024, max_value=16 * 1024 * 1024)
+    size = serializers.IntegerField(min_value=1)
+    missing_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = (
+            'id', 'report', 'filename', 'size', 'chunk_size',
+            'checksum', 'position', 'expand', 'missing_chunks'
+        )
+
+    def validate_checksum(self, value):
+        # stored and compared as lowercase hex, see find_duplicate
+        return value.lower()
+
+    def get_missing_chunks(self, obj):
+        from .uploads import get_missing_chunks
+        return get_missing_chunks(obj)
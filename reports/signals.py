@@ -0,0 +1,107 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from appointment_requests.models import InsuranceCase
+from .models import Report, ArchivedReport, AdditionalImage, ReportTemplate, ImageUpload, TypeOfVisit
+
+
+@receiver(post_delete, sender=Report)
+@receiver(post_delete, sender=ArchivedReport)
+def submission_delete(sender, instance, **kwargs):
+    if instance.is_archived:
+        from .archive import get_bundle_name, remove_bundle_members
+        bundle = get_bundle_name(instance.date_of_visit)
+        prefix = str(instance.pk) + '/'
+        transaction.on_commit(lambda: remove_bundle_members(bundle, prefix))
+        return
+
+    path = str(os.path.join(
+                    settings.MEDIA_ROOT,
+                    'FILES',
+                    str(instance.pk)
+                    ))
+    transaction.on_commit(lambda: shutil.rmtree(path, ignore_errors=True))
+
+
+@receiver(post_save, sender=Report)
+@receiver(post_save, sender=ArchivedReport)
+def case_reported(sender, instance, created, **kwargs):
+    old_case = getattr(instance, '_loaded_values', {}).get('case_id')
+    if created or old_case != instance.case_id:
+        cases = {instance.case_id, old_case} - {None}
+        InsuranceCase.objects.filter(pk__in=cases).refresh_state()
+
+
+@receiver(post_delete, sender=Report)
+@receiver(post_delete, sender=ArchivedReport)
+def case_unreported(sender, instance, **kwargs):
+    InsuranceCase.objects.filter(pk=instance.case_id).refresh_state()
+
+
+@receiver(pre_save, sender=TypeOfVisit)
+def type_of_visit_snapshot(sender, instance, **kwargs):
+    if instance.pk:
+        instance._old_initial = TypeOfVisit.objects.filter(pk=instance.pk).values_list('initial', flat=True).first()
+
+
+@receiver(post_save, sender=TypeOfVisit)
+def type_of_visit_changed(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_old_initial', instance.initial) != instance.initial:
+        Report.objects.filter(type_of_visit=instance).restamp()
+        ArchivedReport.objects.filter(type_of_visit=instance).restamp()
+
+
+def release_file(field_file):
+    storage, name = field_file.storage, field_file.name
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(pre_save, sender=AdditionalImage)
+def image_update(sender, instance, **kwargs):
+    if instance.pk:
+        try:
+            old_image = AdditionalImage.objects.get(pk=instance.pk).image
+        except AdditionalImage.DoesNotExist:
+            return
+        if old_image.name != instance.image.name:
+            release_file(old_image)
+
+
+@receiver(post_delete, sender=AdditionalImage)
+def image_delete(sender, instance, **kwargs):
+    release_file(instance.image)
+
+
+@receiver(pre_save, sender=ReportTemplate)
+def template_update(sender, instance, **kwargs):
+    if instance.pk:
+        try:
+            old_template = ReportTemplate.objects.get(pk=instance.pk).template
+        except ReportTemplate.DoesNotExist:
+            return
+        if old_template.name != instance.template.name:
+            release_file(old_template)
+
+
+@receiver(post_delete, sender=ReportTemplate)
+def template_delete(sender, instance, **kwargs):
+    release_file(instance.template)
+
+
+@receiver(post_delete, sender=ImageUpload)
+def upload_delete(sender, instance, **kwargs):
+    path = instance.path
+
+    def remove_part():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    transaction.on_commit(remove_part)
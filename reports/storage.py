@@ -0,0 +1,85 @@
+import os
+import hashlib
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+READ_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file once under BLOBS/<ab>/<cd>/<sha256><ext> and counts
+    references to it in StoredBlob. A blob is removed from the disk only
+    when its last reference is deleted.
+    """
+    prefix = 'BLOBS'
+
+    def get_blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(self.prefix, digest[:2], digest[2:4], digest + extension)
+
+    def get_digest(self, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            with open(content.temporary_file_path(), 'rb') as f:
+                for block in iter(lambda: f.read(READ_SIZE), b''):
+                    digest.update(block)
+        else:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+            if hasattr(content, 'seek'):
+                content.seek(0)
+        return digest.hexdigest()
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def write(self, full_path, content):
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.replace(tmp_path, full_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        name = self.get_blob_name(self.get_digest(content), name)
+        full_path = self.path(name)
+
+        # the locked blob row serializes writers with release() of the same blob
+        with transaction.atomic():
+            blob, created = (
+                        StoredBlob.objects.select_for_update()
+                        .get_or_create(name=name, defaults={'size': content.size, 'references': 0})
+                        )
+            if created or not os.path.exists(full_path):
+                self.write(full_path, content)
+            StoredBlob.objects.filter(name=name).update(references=F('references') + 1)
+        return name
+
+    def delete(self, name):
+        from .models import StoredBlob
+
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.references > 1:
+                StoredBlob.objects.filter(name=name).update(references=F('references') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            # still holding the row lock, so no writer can reuse the file meanwhile
+            super(ContentAddressedStorage, self).delete(name)
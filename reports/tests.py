@@ -1,3 +1,386 @@
-from django.test import TestCase
+import os
+import shutil
+import zipfile
+import datetime
+import hashlib
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from appointment_requests.models import InsuranceCase
+from medical_center.testing import create_city, create_doctor, create_company, create_case, create_report
+from .archive import archive_batch, archive_reports, get_bundle_path, read_bundle_member, remove_bundle_members, write_bundle
+from .management.commands.profile_startup import profile_imports
+from .models import (
+    Report, ReportVersionConflict, Service, ServiceItem, AdditionalImage, ImageUpload, StoredBlob,
+    ArchivedReport, Disease,
+)
+from .storage import ContentAddressedStorage
+
+# modules that must only be imported when the feature is used
+LAZY_MODULES = (
+    'PIL',
+    'reports.archive',
+    'reports.storage',
+    'reports.uploads',
+    'territories.importers',
+    'territories.spatial',
+)
+
+
+class StartupTest(SimpleTestCase):
+
+    def test_cold_start(self):
+        limit = float(os.environ.get('STARTUP_TIME_LIMIT', 3.0))
+        total, modules, loaded = profile_imports()
+        profiled = {name for name, self_time, cumulative in modules}
+
+        self.assertLess(total, limit)
+        # apps and models are loaded through importlib.import_module
+        self.assertIn('reports.models', profiled)
+        self.assertIn('rest_framework_jwt', loaded)
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, loaded)
+
+
+class MediaTestCase(TestCase):
+    """
+    Runs with MEDIA_ROOT in a temporary directory.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class ImageUploadTest(MediaTestCase):
+
+    def setUp(self):
+        super(ImageUploadTest, self).setUp()
+        permissions = ['add_imageupload', 'change_imageupload', 'delete_imageupload']
+        self.doctor = create_doctor('doctor', create_city(), permissions=permissions)
+        self.report = create_report(create_case(self.doctor, create_company()))
+        self.content = os.urandom(100 * 1024)
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def start(self):
+        response = self.client.post(reverse('image-upload-list'), {
+            'report': self.report.pk,
+            'filename': 'scan.jpg',
+            'size': len(self.content),
+            'chunk_size': 64 * 1024,
+            'checksum': hashlib.sha256(self.content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def put_chunk(self, upload, index, checksum=None):
+        chunk = self.content[index * 64 * 1024:(index + 1) * 64 * 1024]
+        return self.client.put(
+                            reverse('image-upload-chunk', args=[upload, index]),
+                            chunk,
+                            content_type='application/octet-stream',
+                            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(chunk).hexdigest()
+                            )
+
+    def test_resumable_upload(self):
+        upload = self.start()
+        self.assertEqual(self.put_chunk(upload, 1).status_code, 204)
+
+        response = self.client.get(reverse('image-upload-detail', args=[upload]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['missing_chunks'], [0])
+        self.assertEqual(self.client.post(reverse('image-upload-complete', args=[upload])).status_code, 400)
+
+        self.assertEqual(self.put_chunk(upload, 0).status_code, 204)
+        response = self.client.post(reverse('image-upload-complete', args=[upload]))
+        self.assertEqual(response.status_code, 201)
+
+        image = AdditionalImage.objects.get(report=self.report)
+        self.assertEqual(image.position, 1)
+        with image.image.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_duplicate_is_not_uploaded_again(self):
+        upload = self.start()
+        self.put_chunk(upload, 0)
+        self.put_chunk(upload, 1)
+        self.client.post(reverse('image-upload-complete', args=[upload]))
+
+        response = self.client.post(reverse('image-upload-list'), {
+            'report': self.report.pk,
+            'filename': 'copy.jpg',
+            'size': len(self.content),
+            'chunk_size': 64 * 1024,
+            'checksum': hashlib.sha256(self.content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.data)
+
+    def test_duplicate_checksum_case(self):
+        upload = self.start()
+        self.put_chunk(upload, 0)
+        self.put_chunk(upload, 1)
+        self.client.post(reverse('image-upload-complete', args=[upload]))
+
+        response = self.client.post(reverse('image-upload-list'), {
+            'report': self.report.pk,
+            'filename': 'copy.jpg',
+            'size': len(self.content),
+            'chunk_size': 64 * 1024,
+            'checksum': hashlib.sha256(self.content).hexdigest().upper(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AdditionalImage.objects.get().checksum, hashlib.sha256(self.content).hexdigest())
+
+    def test_bad_chunk_checksum(self):
+        upload = self.start()
+        self.assertEqual(self.put_chunk(upload, 0, checksum='0' * 64).status_code, 400)
+
+    def test_delete(self):
+        upload = self.start()
+        self.assertEqual(self.client.delete(reverse('image-upload-detail', args=[upload])).status_code, 204)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_requires_permission(self):
+        self.client.force_authenticate(create_doctor('reader', self.doctor.city, initials='RD').user)
+        response = self.client.post(reverse('image-upload-list'), {}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ReportConcurrencyTest(TestCase):
+
+    def setUp(self):
+        self.doctor = create_doctor('doctor', create_city(), permissions=['change_report'])
+        self.report = create_report(create_case(self.doctor, create_company()))
+        self.service = Service.objects.create(
+                                        name='X-ray',
+                                        country=self.doctor.city.district.region.country,
+                                        price=30,
+                                        price_doctor=20
+                                        )
+        self.url = reverse('report-detail', args=[self.report.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def patch(self, data, etag=None):
+        headers = {'HTTP_IF_MATCH': etag} if etag else {}
+        return self.client.patch(self.url, data, format='json', **headers)
+
+    def test_service_items_bump_version(self):
+        etag = self.client.get(self.url)['ETag']
+        items = {'service_items': [{'service': self.service.pk, 'quantity': 2, 'cost': '60.00'}]}
+
+        response = self.patch(items, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(Report.objects.get(pk=self.report.pk).version, self.report.version + 1)
+
+        # a client still holding the old ETag can no longer overwrite them
+        response = self.patch({'service_items': []}, etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(ServiceItem.objects.filter(report=self.report).count(), 1)
+
+    def test_unchanged_service_items_keep_version(self):
+        items = {'service_items': [{'service': self.service.pk, 'quantity': 1}]}
+        etag = self.patch(items)['ETag']
+        self.assertEqual(self.patch(items, etag)['ETag'], etag)
+
+    def test_diagnosis_bumps_version(self):
+        country = self.doctor.city.district.region.country
+        flu = Disease.objects.create(name='Flu', country=country)
+        cold = Disease.objects.create(name='Cold', country=country)
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.patch({'diagnosis': [flu.pk]}, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.patch({'diagnosis': [flu.pk]}, response['ETag'])['ETag'], response['ETag'])
+        self.assertEqual(self.patch({'diagnosis': [cold.pk]}, etag).status_code, 412)
+        self.assertEqual(list(Report.objects.get(pk=self.report.pk).diagnosis.all()), [flu])
+
+    def test_deferred_field_is_saved(self):
+        report = Report.objects.only('pk', 'version', 'case', 'type_of_visit', 'full_ref_number').get(pk=self.report.pk)
+        report.checkup = 'Better'
+        report.save()
+        report = Report.objects.get(pk=self.report.pk)
+        self.assertEqual(report.checkup, 'Better')
+        self.assertEqual(report.version, self.report.version + 1)
+
+    def test_stale_field_update(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.patch({'checkup': 'Better'}, etag).status_code, 200)
+        self.assertEqual(self.patch({'checkup': 'Worse'}, etag).status_code, 412)
+        self.assertEqual(Report.objects.get(pk=self.report.pk).checkup, 'Better')
+
+    def test_concurrent_save_conflicts(self):
+        first = Report.objects.get(pk=self.report.pk)
+        second = Report.objects.get(pk=self.report.pk)
+        first.checkup = 'Better'
+        first.save()
+        second.prescription = 'Other'
+        with self.assertRaises(ReportVersionConflict), transaction.atomic():
+            second.save()
+        with self.assertRaises(ReportVersionConflict), transaction.atomic():
+            second.set_service_items([{'service': self.service, 'quantity': 1}])
+
+
+class ReportCaseOwnershipTest(TestCase):
+
+    def setUp(self):
+        city = create_city()
+        company = create_company()
+        self.doctor = create_doctor('doctor', city, permissions=['add_report', 'change_report'])
+        self.report = create_report(create_case(self.doctor, company))
+        self.report.diagnosis.add(Disease.objects.create(name='Flu', country=city.district.region.country))
+        self.own_case = create_case(self.doctor, company, ref_number=2)
+        self.other_case = create_case(create_doctor('other', city, initials='OT'), company, ref_number=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+        self.url = reverse('report-detail', args=[self.report.pk])
+
+    def post(self, case):
+        data = self.client.get(self.url).data
+        data.update(case=case.pk, service_items=[])
+        return self.client.post(reverse('report-list'), data, format='json')
+
+    def test_create(self):
+        response = self.post(self.other_case)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('case', response.data)
+        self.assertFalse(Report.objects.filter(case=self.other_case).exists())
+        self.assertEqual(self.post(self.own_case).status_code, 201)
+
+    def test_move_to_another_case(self):
+        response = self.client.patch(self.url, {'case': self.other_case.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Report.objects.get(pk=self.report.pk).case_id, self.report.case_id)
+        response = self.client.patch(self.url, {'case': self.own_case.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_may_use_any_case(self):
+        self.doctor.user.is_staff = True
+        self.doctor.user.save()
+        self.assertEqual(self.post(self.other_case).status_code, 201)
+
+
+class ContentAddressedStorageTest(MediaTestCase):
+
+    def setUp(self):
+        super(ContentAddressedStorageTest, self).setUp()
+        self.storage = ContentAddressedStorage()
+
+    def test_reference_counting(self):
+        first = self.storage.save('a.jpg', ContentFile(b'image'))
+        second = self.storage.save('b.JPG', ContentFile(b'image'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('BLOBS/'))
+        self.assertEqual(StoredBlob.objects.get(name=first).references, 2)
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(StoredBlob.objects.get(name=first).references, 1)
+
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredBlob.objects.filter(name=first).exists())
+
+    def test_save_after_last_release(self):
+        name = self.storage.save('a.jpg', ContentFile(b'image'))
+        self.storage.delete(name)
+        self.assertEqual(self.storage.save('a.jpg', ContentFile(b'image')), name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(StoredBlob.objects.get(name=name).references, 1)
+
+    def test_missing_file_is_rewritten(self):
+        name = self.storage.save('a.jpg', ContentFile(b'image'))
+        os.remove(self.storage.path(name))
+        self.storage.save('a.jpg', ContentFile(b'image'))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'image')
+
+    def test_dedupe_media(self):
+        report = create_report(create_case(create_doctor('doctor', create_city()), create_company()))
+        images = []
+        for position, filename in enumerate(('one.jpg', 'two.jpg'), 1):
+            legacy = os.path.join('FILES', str(report.pk), filename)
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, legacy)), exist_ok=True)
+            with open(os.path.join(self.media_root, legacy), 'wb') as f:
+                f.write(b'same scan')
+            images.append(AdditionalImage.objects.create(report=report, image=legacy, position=position))
+
+        call_command('dedupe_media', stdout=StringIO())
+
+        names = {image.image.name for image in AdditionalImage.objects.all()}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(name.startswith('BLOBS/'))
+        self.assertEqual(StoredBlob.objects.get(name=name).references, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'FILES', str(report.pk), 'one.jpg')))
+
+
+class ArchiveTest(MediaTestCase):
+
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        self.case = create_case(create_doctor('doctor', create_city()), create_company())
+        self.report = create_report(self.case, date_of_visit=datetime.date(2018, 4, 2))
+        self.report.diagnosis.add(Disease.objects.create(name='Flu', country=self.case.country))
+        self.image = AdditionalImage(report=self.report, position=1)
+        self.image.image.save('scan.jpg', ContentFile(b'scan'))
+
+    def test_archive_batch(self):
+        self.assertTrue(InsuranceCase.objects.get(pk=self.case.pk).has_report())
+        self.assertEqual(archive_batch([self.report.pk]), 1)
+
+        self.assertFalse(Report.objects.filter(pk=self.report.pk).exists())
+        archived = ArchivedReport.objects.get(pk=self.report.pk)
+        self.assertEqual(archived.full_ref_number, self.report.full_ref_number)
+        self.assertEqual([disease.name for disease in archived.diagnosis.all()], ['Flu'])
+        image = archived.additional_images.get()
+        member = '/'.join((str(self.report.pk), os.path.basename(self.image.image.name)))
+        self.assertEqual((image.pk, image.bundle, image.member), (self.image.pk, '2018-04.zip', member))
+        self.assertEqual(image.read(), b'scan')
+
+        case = InsuranceCase.objects.get(pk=self.case.pk)
+        self.assertTrue(case.has_report())
+        self.assertEqual(case.state, 'reported')
+
+    def test_has_report(self):
+        case = create_case(self.case.doctor, self.case.company, ref_number=2)
+        self.assertFalse(InsuranceCase.objects.get(pk=case.pk).has_report())
+
+    def test_archive_reports_cutoff(self):
+        create_report(create_case(self.case.doctor, self.case.company, ref_number=2))
+        self.assertEqual(archive_reports(older_than=365), 1)
+        self.assertEqual(list(Report.objects.values_list('case__ref_number', flat=True)), [2])
+
+    def test_write_bundle(self):
+        write_bundle('2018-04.zip', [('1/a.jpg', ContentFile(b'a')), ('2/b.jpg', ContentFile(b'b'))])
+        write_bundle('2018-04.zip', [('1/a.jpg', ContentFile(b'changed')), ('1/c.jpg', ContentFile(b'c'))])
+        with zipfile.ZipFile(get_bundle_path('2018-04.zip')) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['1/a.jpg', '1/c.jpg', '2/b.jpg'])
+        self.assertEqual(read_bundle_member('2018-04.zip', '1/a.jpg'), b'a')
+
+    def test_remove_bundle_members(self):
+        remove_bundle_members('2018-04.zip', '1/')
+        write_bundle('2018-04.zip', [('1/a.jpg', ContentFile(b'a')), ('12/b.jpg', ContentFile(b'b'))])
+
+        remove_bundle_members('2018-04.zip', '1/')
+        with zipfile.ZipFile(get_bundle_path('2018-04.zip')) as archive:
+            self.assertEqual(archive.namelist(), ['12/b.jpg'])
+        self.assertEqual(read_bundle_member('2018-04.zip', '12/b.jpg'), b'b')
+
+        remove_bundle_members('2018-04.zip', '12/')
+        self.assertFalse(os.path.exists(get_bundle_path('2018-04.zip')))
@@ -0,0 +1,115 @@
+import os
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction, IntegrityError
+from django.db.models import Max
+from django.utils.translation import ugettext as _
+
+from .models import Report, AdditionalImage, ImageUpload, ImageUploadChunk
+
+READ_SIZE = 64 * 1024
+
+
+class AssembledFile(File):
+    # lets FileSystemStorage move the assembled file in place instead of copying it
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_duplicate(report, checksum):
+    return AdditionalImage.objects.filter(report=report, checksum=checksum).first()
+
+
+def start_upload(report, filename, size, chunk_size, checksum, position=None, expand=False):
+    duplicate = find_duplicate(report, checksum)
+    if duplicate is not None:
+        return None, duplicate
+
+    upload = ImageUpload.objects.create(
+                                    report=report,
+                                    filename=os.path.basename(filename),
+                                    size=size,
+                                    chunk_size=chunk_size,
+                                    checksum=checksum,
+                                    position=position,
+                                    expand=expand
+                                    )
+    os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+    with open(upload.path, 'wb') as f:
+        f.truncate(size)
+    return upload, None
+
+
+def write_chunk(upload, index, stream, checksum):
+    if index >= upload.chunk_count:
+        raise ValidationError(_('Chunk index is out of range.'))
+
+    length = upload.get_chunk_length(index)
+    offset = index * upload.chunk_size
+    digest = hashlib.sha256()
+    written = 0
+
+    fd = os.open(upload.path, os.O_WRONLY)
+    try:
+        while written < length:
+            block = stream.read(min(READ_SIZE, length - written))
+            if not block:
+                break
+            os.pwrite(fd, block, offset + written)
+            digest.update(block)
+            written += len(block)
+    finally:
+        os.close(fd)
+
+    if written != length or stream.read(1):
+        raise ValidationError(_('Chunk size does not match.'))
+    if digest.hexdigest() != checksum.lower():
+        raise ValidationError(_('Chunk checksum does not match.'))
+
+    try:
+        ImageUploadChunk.objects.update_or_create(upload=upload, index=index, defaults={'checksum': checksum})
+    except IntegrityError:
+        # a parallel retry of the same chunk has been recorded first
+        pass
+
+
+def get_missing_chunks(upload):
+    received = set(upload.chunks.values_list('index', flat=True))
+    return [index for index in range(upload.chunk_count) if index not in received]
+
+
+def complete_upload(upload):
+    missing = get_missing_chunks(upload)
+    if missing:
+        raise ValidationError(_('Missing chunks: {}').format(', '.join(map(str, missing))))
+    if file_checksum(upload.path) != upload.checksum.lower():
+        raise ValidationError(_('File checksum does not match.'))
+
+    with transaction.atomic():
+        report = Report.objects.select_for_update().get(pk=upload.report_id)
+        image = find_duplicate(report, upload.checksum)
+        if image is None:
+            position = upload.position
+            if position is None:
+                position = (report.additional_images.aggregate(last=Max('position'))['last'] or 0) + 1
+            image = AdditionalImage(
+                                report=report,
+                                position=position,
+                                expand=upload.expand,
+                                checksum=upload.checksum
+                                )
+            with open(upload.path, 'rb') as f:
+                image.image.save(upload.filename, AssembledFile(f), save=False)
+            image.save()
+        upload.delete()
+    return image
@@ -0,0 +1,8 @@
+from rest_framework.routers import DefaultRouter
+from .views import ReportViewSet, ImageUploadViewSet
+
+router = DefaultRouter()
+router.register(r'reports', ReportViewSet, basename='report')
+router.register(r'uploads', ImageUploadViewSet, basename='image-upload')
+
+urlpatterns = router.urls
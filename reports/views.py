@@ -1,3 +1,176 @@
-from django.shortcuts import render
+import mimetypes
 
-# Create your views here.
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import viewsets, mixins, status, exceptions
+from rest_framework import permissions
+from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.response import Response
+import django_filters.rest_framework
+
+from .models import Report, ArchivedReport, ImageUpload, ReportVersionConflict
+from .serializers import ReportSerializer, ArchivedReportSerializer
+from .serializers import AdditionalImageSerializer, ImageUploadSerializer
+
+
+class PreconditionFailed(exceptions.APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The report has been changed by someone else.'
+    default_code = 'precondition_failed'
+
+
+def get_etag(report):
+    return '"{}-{}"'.format(report.pk, report.version)
+
+
+class ReportViewSet(viewsets.ModelViewSet):
+    permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    serializer_class = ReportSerializer
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+    filterset_fields = ['checked', 'date_of_visit', 'type_of_visit', 'city', 'company_ref_number', 'full_ref_number']
+    related = ('case__company', 'case__doctor', 'type_of_visit', 'city')
+    prefetched = ('diagnosis', 'service_items', 'additional_images')
+
+    def restrict(self, queryset):
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(case__doctor=self.request.user.profile)
+        return queryset
+
+    def get_queryset(self):
+        return self.restrict(
+                    Report.objects.select_related(*self.related).prefetch_related(*self.prefetched)
+                    )
+
+    def get_archived_queryset(self):
+        return self.restrict(
+                    ArchivedReport.objects.select_related(*self.related).prefetch_related(*self.prefetched)
+                    )
+
+    def get_object(self):
+        try:
+            return super(ReportViewSet, self).get_object()
+        except Http404:
+            if self.request.method not in permissions.SAFE_METHODS and self.action != 'destroy':
+                raise
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = get_object_or_404(self.get_archived_queryset(), pk=self.kwargs[lookup_url_kwarg])
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_serializer(self, *args, **kwargs):
+        if args and getattr(args[0], 'is_archived', False):
+            kwargs.setdefault('context', self.get_serializer_context())
+            return ArchivedReportSerializer(*args, **kwargs)
+        return super(ReportViewSet, self).get_serializer(*args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        if not instance.is_archived:
+            response['ETag'] = get_etag(instance)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super(ReportViewSet, self).update(request, *args, **kwargs)
+        response['ETag'] = get_etag(self.updated)
+        return response
+
+    def perform_update(self, serializer):
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if if_match is not None and if_match.strip() not in ('*', get_etag(serializer.instance)):
+            raise PreconditionFailed()
+        try:
+            self.updated = serializer.save()
+        except ReportVersionConflict:
+            raise PreconditionFailed()
+
+    def list(self, request, *args, **kwargs):
+        archived = request.query_params.get('archived', 'false').lower()
+        context = self.get_serializer_context()
+        data = []
+        if archived in ('false', 'all'):
+            queryset = self.filter_queryset(self.get_queryset())
+            data += ReportSerializer(queryset, many=True, context=context).data
+        if archived in ('true', 'all'):
+            queryset = self.filter_queryset(self.get_archived_queryset())
+            data += ArchivedReportSerializer(queryset, many=True, context=context).data
+        return Response(data)
+
+    @action(detail=True, url_path=r'images/(?P<image_pk>[0-9]+)', url_name='image')
+    def image(self, request, pk=None, image_pk=None):
+        report = self.get_object()
+        image = get_object_or_404(report.additional_images.all(), pk=image_pk)
+        if report.is_archived:
+            content_type = mimetypes.guess_type(image.name)[0] or 'application/octet-stream'
+            return HttpResponse(image.read(), content_type=content_type)
+        from .sendfile import sendfile_response
+        return sendfile_response(image.image.storage, image.image.name)
+
+
+class ImageUploadViewSet(mixins.CreateModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
+    serializer_class = ImageUploadSerializer
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+
+    def get_queryset(self):
+        queryset = ImageUpload.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(report__case__doctor=self.request.user.profile)
+        return queryset
+
+    def image_response(self, image, status_code=status.HTTP_200_OK):
+        serializer = AdditionalImageSerializer(image, context=self.get_serializer_context())
+        return Response({'image': serializer.data}, status=status_code)
+
+    def create(self, request, *args, **kwargs):
+        from .uploads import start_upload
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        report = data['report']
+        if not request.user.is_staff and report.case.doctor_id != request.user.profile.pk:
+            raise serializers.ValidationError({'report': 'Invalid report.'})
+
+        upload, duplicate = start_upload(
+                                    report,
+                                    data['filename'],
+                                    data['size'],
+                                    data['chunk_size'],
+                                    data['checksum'],
+                                    position=data.get('position'),
+                                    expand=data.get('expand', False)
+                                    )
+        if duplicate is not None:
+            return self.image_response(duplicate)
+        return Response(self.get_serializer(upload).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>[0-9]+)')
+    def chunk(self, request, pk=None, index=None):
+        from .uploads import write_chunk
+
+        upload = self.get_object()
+        checksum = request.META.get('HTTP_X_CHUNK_SHA256', '')
+        if not checksum:
+            raise serializers.ValidationError({'checksum': 'X-Chunk-SHA256 header is required.'})
+        try:
+            write_chunk(upload, int(index), request.stream, checksum)
+        except ValidationError as e:
+            raise serializers.ValidationError({'chunk': e.messages})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        from .uploads import complete_upload
+
+        upload = self.get_object()
+        try:
+            image = complete_upload(upload)
+        except ValidationError as e:
+            raise serializers.ValidationError({'upload': e.messages})
+        return self.image_response(image, status.HTTP_201_CREATED)
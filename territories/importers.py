@@ -0,0 +1,335 @@
+import io
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from insurance_companies.models import PriceGroup, Tariff, VisitTariff
+from reports.models import Service, Disease, TypeOfVisit
+
+from .models import Country, Region, District, City
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(fileobj, file_format):
+    if isinstance(fileobj.read(0), bytes):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig')
+    if file_format == 'csv':
+        yield from csv.DictReader(fileobj)
+    elif file_format == 'jsonl':
+        for line in fileobj:
+            if line.strip():
+                # a bad line is reported against its row instead of failing the file
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield RowError('Invalid JSON: {}'.format(e))
+    elif file_format == 'json':
+        yield from json.load(fileobj)
+    else:
+        raise ValueError('Unknown format: {}'.format(file_format))
+
+
+def to_bool(value):
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def to_decimal(value, field):
+    try:
+        return Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError('{}: "{}" is not a number'.format(field, value))
+
+
+def to_float(value, field):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise RowError('{}: "{}" is not a number'.format(field, value))
+
+
+class BaseImporter:
+    """
+    Validates a whole file against in-memory maps of the existing rows and
+    writes the valid objects with bulk_create. Nothing is written if any
+    row fails.
+    """
+    model = None
+    required = ()
+    batch_size = 1000
+
+    def __init__(self):
+        self.countries = dict(Country.objects.values_list('name', 'pk'))
+
+    def load(self):
+        pass
+
+    def get_country(self, row):
+        try:
+            return self.countries[row['country']]
+        except KeyError:
+            raise RowError('Unknown country "{}"'.format(row['country']))
+
+    def build(self, row):
+        raise NotImplementedError
+
+    def created(self, objects):
+        pass
+
+    def validate(self, obj, exclude=()):
+        try:
+            obj.clean_fields(exclude=exclude)
+        except ValidationError as e:
+            raise RowError('; '.join(
+                '{}: {}'.format(field, ' '.join(messages)) for field, messages in e.message_dict.items()
+            ))
+        return obj
+
+    def run(self, rows, dry_run=False):
+        self.load()
+        objects, errors = [], []
+        for number, row in enumerate(rows, 1):
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError('Row must be an object')
+                row = {key.strip(): str(value).strip() for key, value in row.items() if key and value is not None}
+                missing = [field for field in self.required if not row.get(field)]
+                if missing:
+                    raise RowError('Missing fields: {}'.format(', '.join(missing)))
+                objects.append(self.build(row))
+            except RowError as e:
+                errors.append({'row': number, 'error': str(e)})
+
+        if not errors and not dry_run:
+            with transaction.atomic():
+                self.model.objects.bulk_create(objects, batch_size=self.batch_size)
+                self.created(objects)
+        return {
+            'rows': len(objects) + len(errors),
+            'created': 0 if errors or dry_run else len(objects),
+            'errors': errors,
+        }
+
+
+class RegionImporter(BaseImporter):
+    model = Region
+    required = ('country', 'name')
+
+    def load(self):
+        self.regions = set(Region.objects.values_list('country', 'name'))
+
+    def build(self, row):
+        key = (self.get_country(row), row['name'])
+        if key in self.regions:
+            raise RowError('Region "{}" already exists'.format(row['name']))
+        self.regions.add(key)
+        region = Region(country_id=key[0], name=key[1], is_city_state=to_bool(row.get('is_city_state', '')))
+        return self.validate(region, exclude=['country'])
+
+
+class TerritoryImporter(BaseImporter):
+
+    def load(self):
+        self.regions = {
+            (country, name): pk for pk, country, name in Region.objects.values_list('pk', 'country', 'name')
+        }
+        self.districts = {
+            (country, region, name): pk
+            for pk, country, region, name in District.objects.values_list('pk', 'region__country', 'region__name', 'name')
+        }
+
+    def get_region(self, row):
+        try:
+            return self.regions[(self.get_country(row), row['region'])]
+        except KeyError:
+            raise RowError('Unknown region "{}"'.format(row['region']))
+
+    def get_district(self, row):
+        try:
+            return self.districts[(self.get_country(row), row['region'], row['district'])]
+        except KeyError:
+            raise RowError('Unknown district "{}"'.format(row['district']))
+
+
+class DistrictImporter(TerritoryImporter):
+    model = District
+    required = ('country', 'region', 'name')
+
+    def build(self, row):
+        key = (self.get_country(row), row['region'], row['name'])
+        if key in self.districts:
+            raise RowError('District "{}" already exists'.format(row['name']))
+        region = self.get_region(row)
+        self.districts[key] = None
+        return self.validate(District(region_id=region, name=row['name']), exclude=['region'])
+
+
+class CityImporter(TerritoryImporter):
+    model = City
+    required = ('country', 'region', 'district', 'name')
+
+    def load(self):
+        super(CityImporter, self).load()
+        # city names are unique within a country, see City.validate_unique
+        self.cities = set(City.objects.values_list('district__region__country', 'name'))
+        self.city_countries = set()
+
+    def build(self, row):
+        key = (self.get_country(row), row['name'])
+        if key in self.cities:
+            raise RowError('City "{}" already exists in this country'.format(row['name']))
+        district = self.get_district(row)
+        self.cities.add(key)
+        city = City(
+                district_id=district,
+                name=row['name'],
+                latitude=to_float(row.get('latitude'), 'latitude'),
+                longitude=to_float(row.get('longitude'), 'longitude')
+                )
+        self.city_countries.add(key[0])
+        return self.validate(city, exclude=['district'])
+
+    def created(self, objects):
+        from .spatial import bump_generation
+
+        # bulk_create sends no post_save, let the spatial indexes rebuild
+        for country_id in self.city_countries:
+            transaction.on_commit(lambda country_id=country_id: bump_generation(country_id))
+
+
+class ServiceImporter(BaseImporter):
+    model = Service
+    required = ('country', 'name', 'price', 'price_doctor')
+
+    def load(self):
+        self.services = set(Service.objects.values_list('country', 'name'))
+
+    def build(self, row):
+        key = (self.get_country(row), row['name'])
+        if key in self.services:
+            raise RowError('Service "{}" already exists'.format(row['name']))
+        self.services.add(key)
+        service = Service(
+                        country_id=key[0],
+                        name=key[1],
+                        price=to_decimal(row['price'], 'price'),
+                        price_doctor=to_decimal(row['price_doctor'], 'price_doctor'),
+                        unsummable_price=to_bool(row.get('unsummable_price', ''))
+                        )
+        return self.validate(service, exclude=['country'])
+
+
+class DiseaseImporter(BaseImporter):
+    model = Disease
+    required = ('country', 'name')
+
+    def load(self):
+        self.diseases = set(Disease.objects.values_list('name', flat=True))
+
+    def build(self, row):
+        country = self.get_country(row)
+        if row['name'] in self.diseases:
+            raise RowError('Disease "{}" already exists'.format(row['name']))
+        self.diseases.add(row['name'])
+        return self.validate(Disease(country_id=country, name=row['name']), exclude=['country'])
+
+
+class TypeOfVisitImporter(BaseImporter):
+    model = TypeOfVisit
+    required = ('country', 'name')
+
+    def load(self):
+        self.types = set(TypeOfVisit.objects.values_list('country', 'name'))
+
+    def build(self, row):
+        key = (self.get_country(row), row['name'])
+        if key in self.types:
+            raise RowError('Type of visit "{}" already exists'.format(row['name']))
+        self.types.add(key)
+        type_of_visit = TypeOfVisit(
+                                country_id=key[0],
+                                name=key[1],
+                                short_name=row.get('short_name', ''),
+                                is_second_visit=to_bool(row.get('is_second_visit', '')),
+                                initial=row.get('initial', '')
+                                )
+        return self.validate(type_of_visit, exclude=['country'])
+
+
+class TariffImporter(TerritoryImporter):
+    model = Tariff
+    required = ('country', 'region', 'district', 'price_group')
+
+    def load(self):
+        super(TariffImporter, self).load()
+        self.price_groups = dict(PriceGroup.objects.values_list('name', 'pk'))
+        self.tariffs = {
+            (district, price_group): pk
+            for pk, district, price_group in Tariff.objects.values_list('pk', 'district', 'price_group')
+        }
+
+    def get_price_group(self, row):
+        try:
+            return self.price_groups[row['price_group']]
+        except KeyError:
+            raise RowError('Unknown price group "{}"'.format(row['price_group']))
+
+    def build(self, row):
+        key = (self.get_district(row), self.get_price_group(row))
+        if key in self.tariffs:
+            raise RowError('Tariff already exists')
+        self.tariffs[key] = None
+        return Tariff(district_id=key[0], price_group_id=key[1])
+
+
+class VisitTariffImporter(TariffImporter):
+    model = VisitTariff
+    required = ('country', 'region', 'district', 'price_group', 'type_of_visit', 'price')
+
+    def load(self):
+        super(VisitTariffImporter, self).load()
+        self.types = {
+            (country, name): pk for pk, country, name in TypeOfVisit.objects.values_list('pk', 'country', 'name')
+        }
+        self.visit_tariffs = set(VisitTariff.objects.values_list('tariff', 'type_of_visit'))
+
+    def build(self, row):
+        tariff = self.tariffs.get((self.get_district(row), self.get_price_group(row)))
+        if tariff is None:
+            raise RowError('Unknown tariff')
+        try:
+            type_of_visit = self.types[(self.get_country(row), row['type_of_visit'])]
+        except KeyError:
+            raise RowError('Unknown type of visit "{}"'.format(row['type_of_visit']))
+        if (tariff, type_of_visit) in self.visit_tariffs:
+            raise RowError('Visit tariff already exists')
+        self.visit_tariffs.add((tariff, type_of_visit))
+        visit_tariff = VisitTariff(
+                                tariff_id=tariff,
+                                type_of_visit_id=type_of_visit,
+                                price=to_decimal(row['price'], 'price')
+                                )
+        return self.validate(visit_tariff, exclude=['tariff', 'type_of_visit'])
+
+
+IMPORTERS = {
+    'regions': RegionImporter,
+    'districts': DistrictImporter,
+    'cities': CityImporter,
+    'services': ServiceImporter,
+    'diseases': DiseaseImporter,
+    'types_of_visit': TypeOfVisitImporter,
+    'tariffs': TariffImporter,
+    'visit_tariffs': VisitTariffImporter,
+}
@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from territories.importers import IMPORTERS, read_rows
+
+
+class Command(BaseCommand):
+    requires_system_checks = False
+    help = 'Import territories, services, diseases, types of visits and tariffs from a CSV or JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'json', 'jsonl'), default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the file')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        try:
+            with open(options['path'], 'rb') as f:
+                result = IMPORTERS[options['kind']]().run(read_rows(f, file_format), dry_run=options['dry_run'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            self.stderr.write('Row {row}: {error}'.format(**error))
+        if result['errors']:
+            raise CommandError('{} of {} rows are invalid, nothing was imported'.format(
+                                                                            len(result['errors']),
+                                                                            result['rows']
+                                                                            ))
+        self.stdout.write(self.style.SUCCESS('Imported {created} of {rows} rows'.format(**result)))
@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -44,6 +47,18 @@ class District(models.Model):
 class City(models.Model):
     name = models.CharField(max_length=100, verbose_name=_("Name"))
     district = models.ForeignKey(District, on_delete=models.PROTECT, verbose_name=_("District"))
+    latitude = models.FloatField(
+                                null=True,
+                                blank=True,
+                                validators=[MinValueValidator(-90), MaxValueValidator(90)],
+                                verbose_name=_("Latitude")
+                                )
+    longitude = models.FloatField(
+                                null=True,
+                                blank=True,
+                                validators=[MinValueValidator(-180), MaxValueValidator(180)],
+                                verbose_name=_("Longitude")
+                                )
 
     class Meta:
         unique_together = (('name', 'district',),)
@@ -63,3 +78,40 @@ class City(models.Model):
         self.validate_unique()
         super(City, self).save(*args, **kwargs)
 
+
+class SpatialIndexVersion(models.Model):
+    """
+    Generation of a country's nearest city index. Every process compares it
+    with the generation its in-memory index was built from.
+    """
+    country = models.OneToOneField(
+                                Country,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='+',
+                                verbose_name=_("Country")
+                                )
+    generation = models.PositiveIntegerField(default=0, verbose_name=_("Generation"))
+
+    class Meta:
+        verbose_name = _('Spatial index version')
+        verbose_name_plural = _('Spatial index versions')
+
+    def __str__(self):
+        return ' - '.join((str(self.country_id), str(self.generation)))
+
+
+@receiver(post_save, sender=City)
+def city_spatial_update(sender, instance, **kwargs):
+    from .spatial import city_changed
+
+    country_id = District.objects.filter(pk=instance.district_id).values_list('region__country', flat=True).first()
+    transaction.on_commit(lambda: city_changed(instance.pk, country_id, instance.latitude, instance.longitude))
+
+
+@receiver(post_delete, sender=City)
+def city_spatial_delete(sender, instance, **kwargs):
+    from .spatial import city_deleted
+
+    country_id = District.objects.filter(pk=instance.district_id).values_list('region__country', flat=True).first()
+    transaction.on_commit(lambda: city_deleted(instance.pk, country_id))
@@ -34,3 +34,16 @@ class CitySerializer(serializers.ModelSerializer):
         model = City
         fields = '__all__'
 
+
+class NearestCitySerializer(serializers.Serializer):
+    city = serializers.IntegerField(required=False)
+    latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    country = serializers.IntegerField(required=False)
+    doctor = serializers.IntegerField(required=False)
+    k = serializers.IntegerField(required=False, default=5, min_value=1, max_value=50)
+
+    def validate(self, data):
+        if 'city' not in data and ('latitude' not in data or 'longitude' not in data):
+            raise serializers.ValidationError(_('Either city or latitude and longitude are required.'))
+        return data
@@ -0,0 +1,226 @@
+import math
+import heapq
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+EARTH_RADIUS_KM = 6371.0
+DEGREE_KM = math.pi * EARTH_RADIUS_KM / 180
+CELL_SIZE = 0.25
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Cities bucketed into CELL_SIZE degree cells. Nearest neighbours are
+    searched ring by ring around the query cell until no unseen cell can
+    hold a closer city.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.points = {}
+
+    def get_cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def add(self, key, lat, lon):
+        self.remove(key)
+        cell = self.get_cell(lat, lon)
+        self.points[key] = (lat, lon, cell)
+        self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is not None:
+            keys = self.cells[point[2]]
+            keys.discard(key)
+            if not keys:
+                del self.cells[point[2]]
+
+    def ring(self, ci, cj, radius):
+        if radius == 0:
+            yield ci, cj
+            return
+        for j in range(cj - radius, cj + radius + 1):
+            yield ci - radius, j
+            yield ci + radius, j
+        for i in range(ci - radius + 1, ci + radius):
+            yield i, cj - radius
+            yield i, cj + radius
+
+    def nearest(self, lat, lon, k, accept=None):
+        if not self.cells:
+            return []
+        ci, cj = self.get_cell(lat, lon)
+        max_radius = max(max(abs(i - ci), abs(j - cj)) for i, j in self.cells)
+        heap = []
+
+        for radius in range(max_radius + 1):
+            for cell in self.ring(ci, cj, radius):
+                for key in self.cells.get(cell, ()):
+                    if accept is not None and not accept(key):
+                        continue
+                    point_lat, point_lon, _ = self.points[key]
+                    item = (-distance_km(lat, lon, point_lat, point_lon), key)
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+
+            if len(heap) == k:
+                # any city outside the searched square is at least this far away
+                band = min(89.0, abs(lat) + (radius + 1) * self.cell_size)
+                bound = radius * self.cell_size * DEGREE_KM * math.cos(math.radians(band))
+                if -heap[0][0] <= bound:
+                    break
+
+        return [(key, -distance) for distance, key in sorted(heap, reverse=True)]
+
+
+class CountryIndex:
+
+    def __init__(self, country_id, generation):
+        self.country_id = country_id
+        self.generation = generation
+        self.grid = GridIndex()
+        self.coverage = {}
+
+    def load(self):
+        from profiles.models import DoctorDistrict
+        from .models import City
+
+        cities = (
+            City.objects
+            .filter(district__region__country=self.country_id, latitude__isnull=False, longitude__isnull=False)
+            .values_list('pk', 'latitude', 'longitude')
+        )
+        self.grid = GridIndex()
+        for pk, lat, lon in cities:
+            self.grid.add(pk, lat, lon)
+        self.coverage = {}
+        covered = (
+            DoctorDistrict.cities.through.objects
+            .filter(doctordistrict__country=self.country_id)
+            .values_list('city', 'doctordistrict__doctor')
+        )
+        for city, doctor in covered:
+            self.coverage.setdefault(city, set()).add(doctor)
+        return self
+
+    def reload_coverage(self, city_ids):
+        from profiles.models import DoctorDistrict
+
+        for city in city_ids:
+            self.coverage.pop(city, None)
+        covered = (
+            DoctorDistrict.cities.through.objects
+            .filter(doctordistrict__country=self.country_id, city__in=city_ids)
+            .values_list('city', 'doctordistrict__doctor')
+        )
+        for city, doctor in covered:
+            self.coverage.setdefault(city, set()).add(doctor)
+
+    def nearest(self, lat, lon, k, doctor=None):
+        def accept(city):
+            doctors = self.coverage.get(city)
+            return bool(doctors) and (doctor is None or doctor in doctors)
+
+        return [
+            (city, distance, sorted(self.coverage[city]))
+            for city, distance in self.grid.nearest(lat, lon, k, accept)
+        ]
+
+
+_lock = threading.RLock()
+_indexes = {}
+
+
+def get_generation(country_id):
+    from .models import SpatialIndexVersion
+
+    # read from the primary, a lagging replica would make fresh indexes look stale
+    return (
+        SpatialIndexVersion.objects.using(DEFAULT_DB_ALIAS)
+        .filter(country=country_id)
+        .values_list('generation', flat=True)
+        .first()
+    ) or 0
+
+
+def bump_generation(country_id):
+    from .models import SpatialIndexVersion
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        version, _ = (
+            SpatialIndexVersion.objects.using(DEFAULT_DB_ALIAS)
+            .select_for_update()
+            .get_or_create(country_id=country_id)
+        )
+        version.generation += 1
+        version.save(update_fields=['generation'])
+    return version.generation
+
+
+def get_index(country_id):
+    generation = get_generation(country_id)
+    with _lock:
+        index = _indexes.get(country_id)
+        if index is None or index.generation != generation:
+            index = _indexes[country_id] = CountryIndex(country_id, generation).load()
+        return index
+
+
+def update_index(country_id, update):
+    """
+    Apply a change to this process' index in place and bump the country's
+    generation, so other processes rebuild theirs on their next lookup.
+    If another change was made meanwhile, the local index is dropped too.
+    """
+    with _lock:
+        generation = bump_generation(country_id)
+        index = _indexes.get(country_id)
+        if index is None:
+            return
+        if index.generation == generation - 1:
+            update(index)
+            index.generation = generation
+        else:
+            del _indexes[country_id]
+
+
+def city_changed(city_id, country_id, lat, lon):
+    with _lock:
+        for other_id in list(_indexes):
+            if other_id != country_id and city_id in _indexes[other_id].grid.points:
+                update_index(other_id, lambda index: index.grid.remove(city_id))
+
+    def update(index):
+        if lat is None or lon is None:
+            index.grid.remove(city_id)
+        else:
+            index.grid.add(city_id, lat, lon)
+
+    update_index(country_id, update)
+
+
+def city_deleted(city_id, country_id):
+    update_index(country_id, lambda index: index.grid.remove(city_id))
+
+
+def coverage_changed(country_id, city_ids=None):
+    if city_ids is None:
+        update_index(country_id, lambda index: index.load())
+    else:
+        update_index(country_id, lambda index: index.reload_coverage(list(city_ids)))
+
+
+def nearest_cities(country_id, lat, lon, k=5, doctor=None):
+    return get_index(country_id).nearest(lat, lon, k, doctor)
@@ -1,3 +1,169 @@
-from django.test import TestCase
+import io
+import random
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from medical_center.testing import create_city, create_doctor
+from profiles.models import DoctorDistrict
+from . import spatial
+from .importers import RegionImporter, read_rows
+from .models import City, Region, SpatialIndexVersion
+from .spatial import GridIndex, distance_km, nearest_cities
+
+
+class GridIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.points = {key: (rng.uniform(35, 44), rng.uniform(-10, 4)) for key in range(300)}
+        self.grid = GridIndex()
+        for key, (lat, lon) in self.points.items():
+            self.grid.add(key, lat, lon)
+
+    def brute_force(self, lat, lon, k, accept=lambda key: True):
+        found = sorted(
+                    (distance_km(lat, lon, point_lat, point_lon), key)
+                    for key, (point_lat, point_lon) in self.points.items()
+                    if accept(key)
+                    )
+        return [key for distance, key in found[:k]]
+
+    def test_matches_brute_force(self):
+        rng = random.Random(2)
+        for _ in range(50):
+            lat, lon = rng.uniform(30, 48), rng.uniform(-14, 8)
+            found = self.grid.nearest(lat, lon, 5)
+            self.assertEqual([key for key, distance in found], self.brute_force(lat, lon, 5))
+            self.assertEqual([distance for key, distance in found], sorted(distance for key, distance in found))
+
+    def test_accept_filter(self):
+        def even(key):
+            return key % 2 == 0
+
+        found = self.grid.nearest(40.4, -3.7, 3, even)
+        self.assertEqual([key for key, distance in found], self.brute_force(40.4, -3.7, 3, even))
+
+    def test_move_and_remove(self):
+        self.grid.add(0, 60.0, 30.0)
+        self.assertEqual(self.grid.nearest(60.0, 30.0, 1)[0][0], 0)
+        self.grid.remove(0)
+        self.assertNotIn(0, [key for key, distance in self.grid.nearest(60.0, 30.0, 5)])
+        self.assertEqual(sum(len(keys) for keys in self.grid.cells.values()), len(self.points) - 1)
+
+    def test_empty(self):
+        self.assertEqual(GridIndex().nearest(0, 0, 3), [])
+
+
+# the index is updated by on_commit callbacks, so real transactions are needed
+class CountryIndexTest(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        spatial._indexes.clear()
+        self.madrid = create_city('Madrid', latitude=40.42, longitude=-3.70)
+        self.toledo = create_city('Toledo', latitude=39.86, longitude=-4.02)
+        self.country_id = self.madrid.district.region.country_id
+        self.doctor = create_doctor('doctor', self.madrid)
+        self.coverage = DoctorDistrict.objects.create(doctor=self.doctor, country_id=self.country_id)
+        self.coverage.cities.add(self.madrid, self.toledo)
+
+    def tearDown(self):
+        spatial._indexes.clear()
+
+    def nearest(self, lat=39.9, lon=-4.0, k=5):
+        return [city for city, distance, doctors in nearest_cities(self.country_id, lat, lon, k)]
+
+    def test_nearest_covered(self):
+        self.assertEqual(self.nearest(), [self.toledo.pk, self.madrid.pk])
+        self.assertEqual(nearest_cities(self.country_id, 39.9, -4.0, 1)[0][2], [self.doctor.pk])
+
+    def test_incremental_updates(self):
+        index = spatial.get_index(self.country_id)
+        generation = index.generation
+
+        segovia = create_city('Segovia', latitude=40.95, longitude=-4.12)
+        self.coverage.cities.add(segovia)
+        self.assertEqual(self.nearest(40.9, -4.1, 1), [segovia.pk])
+
+        self.toledo.latitude, self.toledo.longitude = 43.26, -2.93
+        self.toledo.save()
+        self.assertEqual(self.nearest(43.2, -2.9, 1), [self.toledo.pk])
+
+        self.coverage.cities.remove(self.toledo)
+        self.assertNotIn(self.toledo.pk, self.nearest(43.2, -2.9))
+
+        segovia.delete()
+        self.assertEqual(self.nearest(40.9, -4.1), [self.madrid.pk])
+
+        # all of it was applied in place, not rebuilt
+        self.assertIs(spatial.get_index(self.country_id), index)
+        self.assertGreater(index.generation, generation)
+
+    def test_change_from_another_process(self):
+        index = spatial.get_index(self.country_id)
+        # another process imports a city: it only bumps the stored generation
+        City.objects.bulk_create([City(
+                                    name='Segovia',
+                                    district=self.madrid.district,
+                                    latitude=40.95,
+                                    longitude=-4.12
+                                    )])
+        segovia = City.objects.get(name='Segovia')
+        self.coverage.cities.through.objects.create(doctordistrict=self.coverage, city=segovia)
+        SpatialIndexVersion.objects.filter(country=self.country_id).update(generation=index.generation + 5)
+
+        self.assertEqual(self.nearest(40.9, -4.1, 1), [segovia.pk])
+        self.assertIsNot(spatial.get_index(self.country_id), index)
+
+
+class ImporterTest(TestCase):
+
+    def setUp(self):
+        create_city()
+
+    def run_import(self, content, file_format='jsonl', dry_run=False):
+        return RegionImporter().run(read_rows(io.BytesIO(content.encode()), file_format), dry_run=dry_run)
+
+    def test_jsonl(self):
+        result = self.run_import('{"country": "Spain", "name": "Galicia"}\n\n{"country": "Spain", "name": "Murcia"}\n')
+        self.assertEqual(result, {'rows': 2, 'created': 2, 'errors': []})
+        self.assertTrue(Region.objects.filter(name='Murcia').exists())
+
+    def test_invalid_rows_are_reported_per_row(self):
+        result = self.run_import(
+                            '{"country": "Spain", "name": "Galicia"}\n'
+                            '[1, 2]\n'
+                            '{"country": "Spain", "name": \n'
+                            '"Murcia"\n'
+                            '{"country": "France", "name": "Bretagne"}\n'
+                            )
+        self.assertEqual(result['rows'], 5)
+        self.assertEqual(result['created'], 0)
+        self.assertEqual([error['row'] for error in result['errors']], [2, 3, 4, 5])
+        self.assertEqual(result['errors'][0]['error'], 'Row must be an object')
+        self.assertTrue(result['errors'][1]['error'].startswith('Invalid JSON'))
+        self.assertEqual(result['errors'][3]['error'], 'Unknown country "France"')
+        self.assertFalse(Region.objects.filter(name='Galicia').exists())
+
+    def test_json_list_of_non_objects(self):
+        result = self.run_import('[{"country": "Spain", "name": "Galicia"}, "Murcia"]', 'json')
+        self.assertEqual(result['errors'], [{'row': 2, 'error': 'Row must be an object'}])
+
+    def test_csv_missing_fields_and_dry_run(self):
+        result = self.run_import('country,name\nSpain,Galicia\nSpain,\n', 'csv')
+        self.assertEqual(result['errors'], [{'row': 2, 'error': 'Missing fields: name'}])
+        result = self.run_import('country,name\nSpain,Galicia\n', 'csv', dry_run=True)
+        self.assertEqual(result, {'rows': 1, 'created': 0, 'errors': []})
+        self.assertFalse(Region.objects.filter(name='Galicia').exists())
+
+    def test_view_returns_row_errors(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        upload = SimpleUploadedFile('regions.jsonl', b'[1, 2]\n{"country": "Spain", "name": "Galicia"}\n')
+        response = client.post(reverse('territories_import_url', args=['regions']), {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [{'row': 1, 'error': 'Row must be an object'}])
@@ -1,5 +1,6 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import CountryViewSet, RegionViewSet, DistrictViewSet, CityViewSet
+from .views import CountryViewSet, RegionViewSet, DistrictViewSet, CityViewSet, ImportView
 
 router = DefaultRouter()
 router.register(r'countries', CountryViewSet, basename='country')
@@ -7,5 +8,7 @@ router.register(r'regions', RegionViewSet, basename='region')
 router.register(r'districts', DistrictViewSet, basename='district')
 router.register(r'cities', CityViewSet, basename='city')
 
-urlpatterns = router.urls
+urlpatterns = [
+    path('import/<str:kind>/', ImportView.as_view(), name='territories_import_url'),
+] + router.urls
 
@@ -1,9 +1,20 @@
+import os
+
+from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 import django_filters.rest_framework
 
+from medical_center.throttling import coalesced
+
 from .models import Country, Region, District, City
 from .serializers import CountrySerializer, RegionSerializer, DistrictSerializer, CitySerializer
+from .serializers import NearestCitySerializer
 
 
 class CountryViewSet(viewsets.ModelViewSet):
@@ -43,6 +54,7 @@ class CityViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, permissions.DjangoModelPermissions]
     serializer_class = CitySerializer
     filter_backends = [django_filters.rest_framework.DjangoFilterBackend]
+    throttle_scope = None
 
     def get_queryset(self):
         queryset = City.objects.all()
@@ -50,3 +62,62 @@ class CityViewSet(viewsets.ModelViewSet):
             country = self.request.user.profile.city.district.region.country
             queryset = queryset.filter(district__region__country=country)
         return queryset
+
+    @action(detail=False, throttle_scope='nearest')
+    @coalesced
+    def nearest(self, request):
+        from .spatial import nearest_cities
+
+        serializer = NearestCitySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if 'city' in data:
+            origin = get_object_or_404(self.get_queryset().select_related('district__region'), pk=data['city'])
+            if origin.latitude is None or origin.longitude is None:
+                return Response({'city': 'City has no coordinates.'}, status=status.HTTP_400_BAD_REQUEST)
+            lat, lon, country = origin.latitude, origin.longitude, origin.district.region.country_id
+        else:
+            lat, lon = data['latitude'], data['longitude']
+            if request.user.is_staff and 'country' in data:
+                country = data['country']
+            else:
+                country = request.user.profile.city.district.region.country_id
+
+        found = nearest_cities(country, lat, lon, k=data['k'], doctor=data.get('doctor'))
+        names = dict(City.objects.filter(pk__in=[city for city, _, _ in found]).values_list('pk', 'name'))
+        return Response([
+            {
+                'city': city,
+                'name': names.get(city),
+                'distance_km': round(distance, 2),
+                'doctors': doctors,
+            }
+            for city, distance, doctors in found
+        ])
+
+
+class ImportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+    throttle_scope = 'import'
+
+    def post(self, request, kind):
+        from .importers import IMPORTERS, read_rows
+
+        if kind not in IMPORTERS:
+            return Response({'kind': 'Unknown import kind.'}, status=status.HTTP_404_NOT_FOUND)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': 'This field is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        dry_run = request.data.get('dry_run', '').lower() in ('1', 'true')
+        try:
+            result = IMPORTERS[kind]().run(read_rows(upload, file_format), dry_run=dry_run)
+        except ValueError as e:
+            return Response({'file': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if result['errors']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)